@@ -0,0 +1,430 @@
+"""Офлайн-бенчмарк бота: локальная заглушка Bot API и симулированные часы.
+
+Запуск: python bench.py --sizes 1000,10000,100000
+
+Сценарии:
+  * broadcast - одна рассылка на N чатов через outbox и Broadcaster;
+  * handlers  - задержки start / button_handler / handle_date_input (p50/p99);
+  * storage   - стоимость записи состояния для json и sqlite;
+  * replay    - прогон расписаний N чатов на --days дней по симулированным часам.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs
+
+ORIGINAL_CWD = os.getcwd()
+os.environ.setdefault('BOT_TOKEN', '123456:BENCH')
+BENCH_DIR = tempfile.mkdtemp(prefix='napominalka_bench_')
+os.environ.setdefault('DB_FILE', os.path.join(BENCH_DIR, 'bot_data.db'))
+os.environ.setdefault('OUTBOX_FILE', os.path.join(BENCH_DIR, 'outbox.db'))
+os.chdir(BENCH_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from apscheduler.triggers.cron import CronTrigger  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import Application  # noqa: E402
+
+import bot  # noqa: E402
+from broadcast import Broadcaster, ChatHealth  # noqa: E402
+from outbox import Outbox  # noqa: E402
+from scheduler import ChatSchedule, DueScheduler, project_calendar  # noqa: E402
+from storage import JsonStorage, SqliteStorage, WriteBehindPersister  # noqa: E402
+
+logger = logging.getLogger('bench')
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class FakeBotApi:
+    """Заглушка Telegram Bot API на asyncio: задержка, ответы 429 и ошибки по вероятностям"""
+
+    def __init__(self, latency: float, jitter: float, retry_ratio: float, error_ratio: float, retry_after: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.retry_ratio = retry_ratio
+        self.error_ratio = error_ratio
+        self.retry_after = retry_after
+        self.requests: Dict[str, int] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.port = 0
+        self.message_id = 0
+        self.random = random.Random(42)
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                lines = head.decode('latin-1').split('\r\n')
+                path = lines[0].split(' ')[1]
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, payload = await self._handle(path.rsplit('/', 1)[-1], headers, body)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\nConnection: keep-alive\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    def _params(self, headers: dict, body: bytes) -> dict:
+        if headers.get('content-type', '').startswith('application/json'):
+            return json.loads(body or b'{}')
+        params = {}
+        for key, values in parse_qs(body.decode()).items():
+            try:
+                params[key] = json.loads(values[0])
+            except ValueError:
+                params[key] = values[0]
+        return params
+
+    async def _handle(self, method: str, headers: dict, body: bytes):
+        self.requests[method] = self.requests.get(method, 0) + 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.random.random() * self.jitter)
+        params = self._params(headers, body)
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': {
+                'id': 123456, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'
+            }}
+        if method in ('sendMessage', 'editMessageText'):
+            roll = self.random.random()
+            if roll < self.retry_ratio:
+                return 429, {
+                    'ok': False, 'error_code': 429,
+                    'description': f"Too Many Requests: retry after {self.retry_after}",
+                    'parameters': {'retry_after': self.retry_after},
+                }
+            if roll < self.retry_ratio + self.error_ratio:
+                return 403, {'ok': False, 'error_code': 403, 'description': "Forbidden: bot was blocked by the user"}
+            self.message_id += 1
+            chat_id = int(params.get('chat_id', 0))
+            return 200, {'ok': True, 'result': {
+                'message_id': self.message_id,
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group'},
+                'text': params.get('text', ''),
+            }}
+        return 200, {'ok': True, 'result': True}
+
+
+class SimClock:
+    """Часы, которые двигает бенчмарк"""
+
+    def __init__(self, start: datetime.datetime):
+        self.current = start
+
+    def __call__(self) -> datetime.datetime:
+        return self.current
+
+
+def fresh_state(size_dir: str, backend: str) -> None:
+    """Подменить состояние модуля bot на пустое в отдельном каталоге"""
+    os.makedirs(size_dir, exist_ok=True)
+    if backend == 'sqlite':
+        storage = SqliteStorage(os.path.join(size_dir, 'bot_data.db'))
+    else:
+        storage = JsonStorage(os.path.join(size_dir, 'bot_data.json'))
+    bot.bot_data = bot.BotData(storage)
+    bot.outbox = Outbox(os.path.join(size_dir, 'outbox.db'))
+    # Паузы чатов, кэш текстов и отметки outbox от прошлого размера не должны влиять на замер
+    bot.chat_health = ChatHealth()
+    bot.delivering.clear()
+    bot.polled_jobs.clear()
+    bot.next_push_texts.clear()
+
+
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def random_schedules(size: int, today: datetime.date, seed: int = 1) -> List[ChatSchedule]:
+    rnd = random.Random(seed)
+    return [
+        ChatSchedule(
+            chat_id=chat_id,
+            start_date=today + datetime.timedelta(days=rnd.randint(-30, 10)),
+            interval_days=rnd.choice([1, 2, 3, 4, 4, 4, 7]),
+            own_interval_days=True,
+        )
+        for chat_id in range(1, size + 1)
+    ]
+
+
+async def bench_broadcast(application: Application, api: FakeBotApi, size: int) -> dict:
+    """Одна рассылка на size чатов: постановка в outbox и доставка"""
+    today = bot.PushScheduler.today()
+    for chat_id in range(1, size + 1):
+        bot.bot_data.add_chat(chat_id)
+    started = time.perf_counter()
+    bot.outbox.enqueue(bot.DAILY_STATS, 'bench', today, bot.bot_data.iter_chats())
+    enqueue_seconds = time.perf_counter() - started
+    before = dict(api.requests)
+    started = time.perf_counter()
+    await bot.deliver_outbox(application, 'bench', today)
+    seconds = time.perf_counter() - started
+    counts = bot.outbox.counts()
+    return {
+        'enqueue_ms': enqueue_seconds * 1000,
+        'deliver_s': seconds,
+        'sent': counts.get('sent', 0),
+        'failed': counts.get('failed', 0),
+        'api_calls': api.requests.get('sendMessage', 0) - before.get('sendMessage', 0),
+        'msg_per_s': counts.get('sent', 0) / seconds if seconds else 0.0,
+    }
+
+
+def make_update(update_id: int, chat_id: int, text: Optional[str] = None, data: Optional[str] = None) -> dict:
+    user = {'id': chat_id, 'is_bot': False, 'first_name': 'Bench'}
+    chat = {'id': chat_id, 'type': 'private'}
+    if data is not None:
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'from': user, 'chat_instance': str(chat_id), 'data': data,
+            'message': {'message_id': 1, 'date': int(time.time()), 'chat': chat, 'text': 'menu'},
+        }}
+    message = {'message_id': update_id, 'date': int(time.time()), 'chat': chat, 'from': user, 'text': text}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+async def bench_handlers(application: Application, iterations: int) -> dict:
+    """Задержки обработчиков, прогнанных через process_update"""
+    latencies: Dict[str, List[float]] = {'start': [], 'button_handler': [], 'handle_date_input': []}
+    future = (bot.PushScheduler.today() + datetime.timedelta(days=30)).isoformat()
+    update_id = 0
+
+    async def measure(name: str, payload: dict) -> None:
+        update = Update.de_json(payload, application.bot)
+        started = time.perf_counter()
+        await application.process_update(update)
+        latencies[name].append((time.perf_counter() - started) * 1000)
+
+    for i in range(iterations):
+        chat_id = 10_000_000 + i
+        update_id += 1
+        await measure('start', make_update(update_id, chat_id, text='/start'))
+        update_id += 1
+        await measure('button_handler', make_update(update_id, chat_id, data='next_push'))
+        update_id += 1
+        await application.process_update(Update.de_json(make_update(update_id, chat_id, data='set_date'), application.bot))
+        update_id += 1
+        await measure('handle_date_input', make_update(update_id, chat_id, text=future))
+    return {
+        name: {'p50_ms': percentile(values, 50), 'p99_ms': percentile(values, 99)}
+        for name, values in latencies.items()
+    }
+
+
+async def bench_storage(size: int, size_dir: str) -> dict:
+    """Стоимость добавления чатов и сохранения расписаний для каждого бэкенда"""
+    result = {}
+    today = datetime.date.today()
+    schedules = random_schedules(size, today)
+    for backend in ('json', 'sqlite'):
+        path = os.path.join(size_dir, f"storage_{backend}")
+        writes = 0
+
+        def count_write(sql: str) -> None:
+            # SQLite в режиме autocommit: каждая изменяющая команда - отдельная запись на диск
+            nonlocal writes
+            if sql.lstrip().upper().startswith(WRITE_STATEMENTS):
+                writes += 1
+
+        if backend == 'json':
+            storage = JsonStorage(path + '.json')
+            persister = WriteBehindPersister(storage, delay=0.05)
+        else:
+            storage = SqliteStorage(path + '.db')
+            storage.conn.set_trace_callback(count_write)
+            persister = None
+        started = time.perf_counter()
+        for schedule in schedules:
+            storage.add_chat(schedule.chat_id)
+            storage.set_schedule(schedule.chat_id, schedule.to_dict())
+        inline_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        if persister:
+            await persister.close()
+        flush_seconds = time.perf_counter() - started
+        file_path = storage.path
+        storage.close()
+        result[backend] = {
+            'us_per_chat': inline_seconds / size * 1e6,
+            'flush_ms': flush_seconds * 1000,
+            'flushes': persister.stats.flushes if persister else writes,
+            'file_kb': os.path.getsize(file_path) / 1024,
+        }
+    return result
+
+
+async def bench_replay(size: int, days: int) -> dict:
+    """Прогон расписаний по симулированным часам без реальных отправок"""
+    tz = bot.MOSCOW_TZ
+    start = tz.localize(datetime.datetime.combine(datetime.date.today(), datetime.time(0, 0)))
+    end = start + datetime.timedelta(days=days)
+    clock = SimClock(start)
+    schedules = random_schedules(size, start.date())
+    sends = [0] * days
+    calls = {'due': 0, 'cron': 0}
+
+    async def handler(kind: str, fire_at: datetime.datetime, chat_ids: List[int]) -> None:
+        calls['due'] += 1
+        sends[(fire_at.date() - start.date()).days] += len(chat_ids)
+
+    scheduler = DueScheduler(handler, tz, clock=clock)
+    started = time.perf_counter()
+    scheduler.load(schedules)
+    load_seconds = time.perf_counter() - started
+    crons = [CronTrigger(hour=12, minute=0, timezone=tz), CronTrigger(day_of_week='tue', hour=12, minute=0, timezone=tz)]
+    cron_next = [trigger.get_next_fire_time(None, start) for trigger in crons]
+    wakeups = 0
+    started = time.perf_counter()
+    while True:
+        due_at = scheduler.next_fire_time()
+        moment = min(t for t in [due_at] + cron_next if t is not None)
+        if moment >= end:
+            break
+        clock.current = moment
+        wakeups += 1
+        for (kind, fire_at), chat_ids in scheduler.pop_due(moment).items():
+            await handler(kind, fire_at, chat_ids)
+        for i, trigger in enumerate(crons):
+            if cron_next[i] == moment:
+                calls['cron'] += 1
+                cron_next[i] = trigger.get_next_fire_time(moment, moment + datetime.timedelta(seconds=1))
+    seconds = time.perf_counter() - started
+    calendar = project_calendar(schedules, start.date(), days)
+    return {
+        'load_ms': load_seconds * 1000,
+        'replay_s': seconds,
+        'wakeups': wakeups,
+        'due_batches': calls['due'],
+        'cron_runs': calls['cron'],
+        'reminders': sum(sends),
+        'calendar_matches': calendar.sends == sends,
+    }
+
+
+async def run(args: argparse.Namespace) -> dict:
+    api = FakeBotApi(
+        latency=args.latency_ms / 1000,
+        jitter=args.jitter_ms / 1000,
+        retry_ratio=args.retry_ratio,
+        error_ratio=args.error_ratio,
+        retry_after=args.retry_after,
+    )
+    await api.start()
+    bot.broadcaster = Broadcaster(concurrency=args.concurrency, global_rate=args.rate)
+    application = (
+        Application.builder()
+        .token(bot.TOKEN)
+        .base_url(api.base_url)
+        .connection_pool_size(args.concurrency + 8)
+        .build()
+    )
+    bot.add_handlers(application)
+    await application.initialize()
+    report = {}
+    try:
+        for size in args.sizes:
+            size_dir = os.path.join(BENCH_DIR, str(size))
+            fresh_state(size_dir, args.backend)
+            entry = {}
+            entry['broadcast'] = await bench_broadcast(application, api, size)
+            entry['handlers'] = await bench_handlers(application, args.handler_iterations)
+            entry['storage'] = await bench_storage(size, size_dir)
+            entry['replay'] = await bench_replay(size, args.days)
+            await bot.bot_data.close()
+            bot.outbox.close()
+            report[size] = entry
+            print_entry(size, entry)
+    finally:
+        await application.shutdown()
+        await api.stop()
+    return report
+
+
+def print_entry(size: int, entry: dict) -> None:
+    b, r = entry['broadcast'], entry['replay']
+    print(f"\n=== {size} чатов ===")
+    print(
+        f"broadcast: {b['sent']} отправлено, {b['failed']} ошибок, {b['api_calls']} вызовов API, "
+        f"{b['deliver_s']:.2f}с ({b['msg_per_s']:.0f} сообщ/с), outbox enqueue {b['enqueue_ms']:.1f}мс"
+    )
+    for name, values in entry['handlers'].items():
+        print(f"handler {name}: p50 {values['p50_ms']:.2f}мс, p99 {values['p99_ms']:.2f}мс")
+    for backend, values in entry['storage'].items():
+        print(
+            f"storage {backend}: {values['us_per_chat']:.1f}мкс/чат, финальная запись {values['flush_ms']:.1f}мс, "
+            f"записей {values['flushes']}, файл {values['file_kb']:.0f}КБ"
+        )
+    print(
+        f"replay: загрузка {r['load_ms']:.1f}мс, прогон {r['replay_s']:.2f}с, пробуждений {r['wakeups']}, "
+        f"напоминаний {r['reminders']}, совпадает с календарём: {r['calendar_matches']}"
+    )
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Офлайн-бенчмарк бота-напоминалки")
+    parser.add_argument('--sizes', default='1000,10000', type=lambda v: [int(x) for x in v.split(',')])
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='sqlite')
+    parser.add_argument('--latency-ms', type=float, default=5.0)
+    parser.add_argument('--jitter-ms', type=float, default=5.0)
+    parser.add_argument('--retry-ratio', type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--error-ratio', type=float, default=0.0, help="доля ответов 403")
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--rate', type=float, default=1e6, help="глобальный лимит сообщений в секунду")
+    parser.add_argument('--handler-iterations', type=int, default=200)
+    parser.add_argument('--days', type=int, default=90, help="длина прогона по симулированным часам")
+    parser.add_argument('--json', help="куда сохранить отчёт в JSON")
+    parser.add_argument('--verbose', action='store_true')
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.CRITICAL)
+    report = asyncio.run(run(args))
+    if args.json:
+        with open(os.path.join(ORIGINAL_CWD, args.json), 'w') as f:
+            json.dump(report, f, indent=2)
+    print(f"\nКаталог с данными бенчмарка: {BENCH_DIR}")
+
+
+if __name__ == "__main__":
+    main()
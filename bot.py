@@ -1,9 +1,17 @@
 import os
+import argparse
+import asyncio
+import json
+import atexit
 import logging
 import datetime
-import json
-from typing import Optional, Dict, List
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import functools
+import signal
+import sys
+import time
+from typing import Optional, Dict, List, Iterable, Iterator, Set, TextIO, Tuple
+from telegram import CallbackQuery, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -11,306 +19,566 @@ from telegram.ext import (
     MessageHandler,
     filters,
     ContextTypes,
+    Updater,
 )
+from apscheduler.events import EVENT_JOB_SUBMITTED, JobSubmissionEvent
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 import pytz
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+from config import CronJob, ScheduleConfig, load_schedule_config
+from broadcast import CHAT, DEAD, MIGRATED, TRANSIENT, Broadcaster, ChatHealth, DEFAULT_CONCURRENCY, GLOBAL_RATE, classify_failure
+from digest import Due, DigestBuffer, Sources, compose_digest, event_key, join_kinds, split_kinds
+from jobstore import JobStore
+from logs import chat_detail, setup_logging, stop_logging
+from metrics import MetricsServer, registry
+from outbox import Outbox
+from prompts import DATE_PROMPT_TTL, AwaitingDate, PendingPrompts
+from scheduler import (
+    CATCH_UP_COALESCE,
+    CATCH_UP_RUN_ONCE,
+    CATCH_UP_SKIP,
+    MISFIRE_GRACE_SECONDS,
+    PREPARE,
+    PUSH_DAY,
+    ChatSchedule,
+    Clock,
+    DueScheduler,
+    PushCalendar,
+    DEFAULT_INTERVAL_DAYS,
+    first_cycle_after,
+    parse_time,
+    project_calendar,
+    project_push_dates,
+)
+from shard import LEASE_TTL, HashRing, LeaderLease
+from storage import JsonStorage, Storage, WriteBehindPersister, open_storage
+
+# Настройка логирования: запись в stderr идёт из отдельного потока через очередь
+log_listener = setup_logging(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    fmt=os.getenv('LOG_FORMAT', 'json'),
+    # Доля записей по отдельным чатам рассылки, которые видны без DEBUG
+    sample=float(os.getenv('LOG_SAMPLE_RATE', '0')),
 )
+atexit.register(stop_logging, log_listener)
 logger = logging.getLogger(__name__)
 
 # Конфигурация из переменных окружения
+# Токен нужен только для запуска бота, импорт и экспорт чатов работают без него
 TOKEN = os.getenv('BOT_TOKEN')
-if not TOKEN:
-    raise ValueError("BOT_TOKEN не установлен в переменных окружения")
 
 MOSCOW_TZ = pytz.timezone('Europe/Moscow')
-PUSH_INTERVAL_DAYS = 4
+PUSH_INTERVAL_DAYS = int(os.getenv('PUSH_INTERVAL_DAYS', DEFAULT_INTERVAL_DAYS))
+MAX_INTERVAL_DAYS = 365
+# Сколько строк JSONL импортируется одной транзакцией
+IMPORT_BATCH_SIZE = 1000
+# Определения расписаний, перечитываются по SIGHUP и команде /reload
+SCHEDULE_FILE = os.getenv('SCHEDULE_FILE', 'schedule.json')
+# Отметки последних запусков и политика догоняющего запуска: coalesce, run_once или skip
+JOBSTORE_FILE = os.getenv('JOBSTORE_FILE', 'jobs.db')
+CATCH_UP_POLICY = os.getenv('CATCH_UP_POLICY', CATCH_UP_COALESCE)
+MAX_CATCH_UP_RUNS = 50
+# Сколько секунд ждать ответа на запрос даты
+DATE_PROMPT_TIMEOUT = float(os.getenv('DATE_PROMPT_TIMEOUT', DATE_PROMPT_TTL))
+# Сколько секунд переиспользовать посчитанный текст «Следующий пуш»
+NEXT_PUSH_CACHE_TTL = float(os.getenv('NEXT_PUSH_CACHE_TTL', '60'))
+ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()}
 DATA_FILE = 'bot_data.json'
+DB_FILE = os.getenv('DB_FILE', 'bot_data.db')
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+OUTBOX_FILE = os.getenv('OUTBOX_FILE', 'outbox.db')
+OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', 7))
+WRITE_BEHIND_DELAY = float(os.getenv('WRITE_BEHIND_DELAY', 0.5))
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', DEFAULT_CONCURRENCY))
+# Шардирование: WORKER_COUNT процессов делят чаты, cron-задачи у одного лидера
+WORKER_ID = int(os.getenv('WORKER_ID', 0))
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', 1))
+LEASE_FILE = os.getenv('LEASE_FILE', 'lease.db')
+LEASE_TTL_SECONDS = float(os.getenv('LEASE_TTL', LEASE_TTL))
+# Лимит Telegram общий на токен, поэтому делится между воркерами;
+# BROADCAST_RATE задаётся на один воркер, вместе их WORKER_COUNT * BROADCAST_RATE
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', GLOBAL_RATE / WORKER_COUNT))
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+# При WORKER_COUNT > 1 воркер слушает WEBHOOK_PORT + WORKER_ID, балансировщик
+# за WEBHOOK_URL раздаёт запросы по этим портам
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8443))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 16))
+# Окна растянутой доставки в секундах по типам: daily_stats=600,weekly_push=600
+DISPATCH_WINDOWS = {
+    kind.strip(): float(seconds)
+    for kind, seconds in (item.split('=') for item in os.getenv('DISPATCH_WINDOWS', '').split(',') if item.strip())
+}
+# Окно в секундах, за которое совпавшие напоминания собираются в одно сообщение
+DIGEST_WINDOW = float(os.getenv('DIGEST_WINDOW', 30))
+# Повторы рассылки после временных сбоев (сеть, флуд-контроль): число и пауза перед первым
+DELIVERY_RETRIES = int(os.getenv('DELIVERY_RETRIES', 5))
+DELIVERY_RETRY_DELAY = float(os.getenv('DELIVERY_RETRY_DELAY', 30))
+# Порт локального эндпоинта /metrics, 0 - выключен
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+def schedule_file_mtime() -> Optional[float]:
+    """Время изменения файла расписаний (None, если файла нет)"""
+    try:
+        return os.stat(SCHEDULE_FILE).st_mtime
+    except FileNotFoundError:
+        return None
 
 # Глобальные переменные
 class BotData:
-    def __init__(self):
-        self.next_push_date: Optional[datetime.date] = None
-        self.active_chats: List[int] = []
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self.persister: Optional[WriteBehindPersister] = None
+        if isinstance(storage, JsonStorage):
+            # JSON переписывается целиком, поэтому пишем его отложенно вне event loop
+            self.persister = WriteBehindPersister(storage, delay=WRITE_BEHIND_DELAY)
+        # Общая дата из старого формата - старт для чатов без своего расписания
+        self.default_start_date: Optional[datetime.date] = None
         self.scheduler: Optional[AsyncIOScheduler] = None
+        self.push_scheduler: Optional[DueScheduler] = None
+        self.digest: Optional[DigestBuffer] = None
+        # Версия файла, из которой прочитан конфиг: лидер перечитывает файл, когда она меняется
+        self.config_mtime = schedule_file_mtime()
+        self.config: ScheduleConfig = load_schedule_config(SCHEDULE_FILE, interval_days=PUSH_INTERVAL_DAYS)
+        # Cron-задачи, которые сейчас стоят в планировщике
+        self.cron_jobs: Dict[str, CronJob] = {}
+        # Последнее учтённое изменение расписаний из журнала хранилища
+        self.change_seq = 0
+        # Кто из пользователей сейчас вводит дату
+        self.prompts = PendingPrompts(storage, ttl=DATE_PROMPT_TIMEOUT, shared=WORKER_COUNT > 1)
+        self.prompts.load()
         self.load_data()
     
     def load_data(self):
-        """Загрузить данные из файла"""
-        try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                if data.get('next_push_date'):
-                    self.next_push_date = datetime.datetime.strptime(
-                        data['next_push_date'], '%Y-%m-%d'
-                    ).date()
-                self.active_chats = data.get('active_chats', [])
-                logger.info(f"Данные загружены: {data}")
-        except (FileNotFoundError, json.JSONDecodeError):
-            logger.info("Файл данных не найден, устанавливаем дату на завтра")
+        """Загрузить данные из хранилища"""
+        value = self.storage.get_meta('next_push_date')
+        if value:
+            self.default_start_date = datetime.datetime.strptime(value, '%Y-%m-%d').date()
+            logger.info(
+                "Данные загружены: дата по умолчанию %s, чатов %d",
+                self.default_start_date, self.storage.count_chats(),
+            )
+        else:
+            logger.info("Дата пуша не найдена, устанавливаем дату на завтра")
             # Устанавливаем первый пуш на завтра
-            self.next_push_date = datetime.date.today() + datetime.timedelta(days=1)
+            self.default_start_date = datetime.date.today() + datetime.timedelta(days=1)
             self.save_data()
     
     def save_data(self):
-        """Сохранить данные в файл"""
-        data = {
-            'next_push_date': self.next_push_date.strftime('%Y-%m-%d') if self.next_push_date else None,
-            'active_chats': self.active_chats,
-            'last_updated': datetime.datetime.now().isoformat()
-        }
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data, f, indent=2)
-        logger.info(f"Данные сохранены: {data}")
-    
-    def add_chat(self, chat_id: int):
-        """Добавить чат в список активных"""
-        if chat_id not in self.active_chats:
-            self.active_chats.append(chat_id)
-            self.save_data()
-            logger.info(f"Добавлен чат: {chat_id}")
+        """Сохранить дату по умолчанию в хранилище"""
+        value = self.default_start_date.strftime('%Y-%m-%d')
+        self.storage.set_meta('next_push_date', value)
+        logger.debug("Данные сохранены: next_push_date=%s", value)
+    
+    def add_chat(self, chat_id: int) -> bool:
+        """Добавить чат в список активных, вернуть True для нового или вернувшегося чата"""
+        # Чат сам написал боту - прошлые ошибки отправки больше не актуальны
+        chat_health.forget(chat_id)
+        if self.storage.add_chat(chat_id):
+            logger.info("Добавлен чат: %s", chat_id)
+            return True
+        return False
+    
+    def deactivate_chat(self, chat_id: int, reason: str, cause: str = DEAD) -> None:
+        """Выключить мёртвый чат: он пропадает из рассылок и расписания"""
+        if self.storage.deactivate_chat(chat_id, reason):
+            CHATS_DEACTIVATED.inc(reason=cause)
+            logger.warning("Чат %s выключен: %s", chat_id, reason)
+        chat_health.forget(chat_id)
+        next_push_texts.pop(chat_id, None)
+        if self.push_scheduler:
+            self.push_scheduler.remove(chat_id)
+    
+    def migrate_chat(self, old_id: int, new_id: int) -> None:
+        """Перенести чат на id супергруппы вместе с расписанием"""
+        self.storage.migrate_chat(old_id, new_id)
+        chat_health.forget(old_id)
+        next_push_texts.pop(old_id, None)
+        CHATS_DEACTIVATED.inc(reason=MIGRATED)
+        if self.push_scheduler:
+            self.push_scheduler.remove(old_id)
+            self.push_scheduler.update(self.get_schedule(new_id))
+        logger.warning("Чат %s переехал в супергруппу %s", old_id, new_id)
+    
+    def _schedule_from(self, chat_id: int, data: Optional[dict]) -> ChatSchedule:
+        if data:
+            return ChatSchedule.from_dict(
+                chat_id, data, self.config.prepare_times, self.config.push_time, self.config.interval_days
+            )
+        return ChatSchedule(
+            chat_id,
+            self.default_start_date,
+            interval_days=self.config.interval_days,
+            prepare_times=self.config.prepare_times,
+            push_time=self.config.push_time,
+        )
+    
+    def get_schedule(self, chat_id: int) -> ChatSchedule:
+        """Расписание чата (или расписание по умолчанию)"""
+        return self._schedule_from(chat_id, self.storage.get_schedule(chat_id))
+    
+    def save_schedule(self, schedule: ChatSchedule):
+        """Сохранить расписание чата и перепланировать только его"""
+        self.storage.set_schedule(schedule.chat_id, schedule.to_dict())
+        next_push_texts.pop(schedule.chat_id, None)
+        # Выключенный чат (например, нажал старую кнопку) в рассылку не возвращается
+        if self.push_scheduler and self.storage.has_chat(schedule.chat_id):
+            self.push_scheduler.update(schedule)
+    
+    def iter_schedules(self) -> Iterator[ChatSchedule]:
+        """Лениво перебрать расписания всех активных чатов"""
+        for chat_id, data in self.storage.iter_schedules():
+            yield self._schedule_from(chat_id, data)
+    
+    def iter_chats(self) -> Iterator[int]:
+        """Лениво перебрать активные чаты для рассылки"""
+        return self.storage.iter_chats()
+    
+    async def close(self):
+        """Дописать отложенные изменения и закрыть хранилище"""
+        if self.persister:
+            await self.persister.close()
+        self.storage.close()
+
+# chat_id -> (срок годности по time.monotonic(), день расчёта, текст)
+next_push_texts: Dict[int, Tuple[float, datetime.date, str]] = {}
+bot_data = BotData(open_storage(STORAGE_BACKEND, DATA_FILE, DB_FILE, track_changes=WORKER_COUNT > 1))
+ring = HashRing(range(WORKER_COUNT))
+broadcaster = Broadcaster(concurrency=BROADCAST_CONCURRENCY, global_rate=BROADCAST_RATE)
+chat_health = ChatHealth()
+outbox = Outbox(OUTBOX_FILE)
+job_store = JobStore(JOBSTORE_FILE)
+# Отметка в job_store для событий расписаний чатов
+DUE_JOB_ID = 'due_reminders'
+# Рассылки, которые сейчас доставляются: (job, run_date)
+delivering: Set[Tuple[str, datetime.date]] = set()
+# Рассылки, которые воркер уже забрал из outbox
+polled_jobs: Set[Tuple[str, datetime.date]] = set()
+metrics_server: Optional[MetricsServer] = None
+worker_task: Optional[asyncio.Task] = None
+
+# Метрики
+HANDLER_CALLS = registry.counter('bot_handler_calls_total', 'Вызовы обработчиков', ['handler', 'status'])
+HANDLER_LATENCY = registry.histogram('bot_handler_latency_seconds', 'Длительность обработчиков', ['handler'])
+JOB_RUNS = registry.counter('bot_job_runs_total', 'Запуски задач по расписанию', ['job', 'status'])
+JOB_LATENCY = registry.histogram('bot_job_duration_seconds', 'Длительность задач по расписанию', ['job'])
+SCHEDULER_LAG = registry.histogram(
+    'bot_scheduler_lag_seconds', 'Фактическое время запуска минус плановое', ['job']
+)
+SCHEDULER_LAST_LAG = registry.gauge(
+    'bot_scheduler_last_lag_seconds', 'Отставание последнего запуска задачи', ['job']
+)
+CHATS_DEACTIVATED = registry.counter('bot_chats_deactivated_total', 'Выключенные мёртвые чаты', ['reason'])
+registry.gauge('bot_active_chats', 'Активные чаты', function=lambda: bot_data.storage.count_chats())
+registry.gauge('bot_inactive_chats', 'Выключенные чаты', function=lambda: bot_data.storage.count_inactive())
+registry.gauge('bot_chats_backing_off', 'Чаты на паузе после ошибок', function=lambda: chat_health.backing_off())
+registry.gauge('bot_outbox_pending', 'Недоставленные строки outbox', function=lambda: outbox.pending_count())
+registry.gauge(
+    'bot_persist_flush_max_seconds', 'Самая долгая отложенная запись',
+    function=lambda: bot_data.persister.stats.max_flush_seconds if bot_data.persister else 0,
+)
+registry.gauge(
+    'bot_persist_coalesced_writes', 'Изменений, объединённых отложенной записью',
+    function=lambda: bot_data.persister.stats.coalesced if bot_data.persister else 0,
+)
+
+def _instrumented(calls, latency, label: str, name: str):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            status = 'ok'
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                status = 'error'
+                raise
+            finally:
+                latency.observe(time.perf_counter() - started, **{label: name})
+                calls.inc(**{label: name, 'status': status})
+        return wrapper
+    return decorator
+
+def instrument_handler(name: str):
+    """Считать вызовы и длительность обработчика обновлений"""
+    return _instrumented(HANDLER_CALLS, HANDLER_LATENCY, 'handler', name)
 
-bot_data = BotData()
+def instrument_job(name: str):
+    """Считать запуски и длительность задачи по расписанию"""
+    return _instrumented(JOB_RUNS, JOB_LATENCY, 'job', name)
+
+def record_scheduler_lag(job: str, planned: datetime.datetime) -> None:
+    """Записать, насколько запуск отстал от планового времени"""
+    lag = (datetime.datetime.now(planned.tzinfo) - planned).total_seconds()
+    SCHEDULER_LAG.observe(lag, job=job)
+    SCHEDULER_LAST_LAG.set(lag, job=job)
+
+def on_job_submitted(event: JobSubmissionEvent) -> None:
+    """Отставание cron-задач APScheduler"""
+    for planned in event.scheduled_run_times:
+        record_scheduler_lag(event.job_id, planned)
 
 class PushScheduler:
-    """Класс для управления расписанием пушей"""
+    """Класс для управления расписанием пушей чата"""
     
-    @staticmethod
-    def calculate_next_push_date(start_date: datetime.date) -> datetime.date:
-        """Рассчитать следующую дату пуша (каждые 4 дня), НО ТОЛЬКО В БУДУЩЕМ"""
-        today = datetime.date.today()
-        
-        # Если дата в прошлом, вычисляем следующую в будущем
-        if start_date <= today:
-            # Находим разницу в днях
-            days_passed = (today - start_date).days
-            # Находим, сколько полных циклов прошло
-            cycles_passed = days_passed // PUSH_INTERVAL_DAYS
-            # Следующая дата = начальная дата + (циклы + 1) * интервал
-            next_date = start_date + datetime.timedelta(days=(cycles_passed + 1) * PUSH_INTERVAL_DAYS)
-            
-            # Проверяем, что дата в будущем
-            if next_date <= today:
-                next_date += datetime.timedelta(days=PUSH_INTERVAL_DAYS)
-        else:
-            # Если дата в будущем, просто возвращаем ее
-            next_date = start_date
-        
-        return next_date
+    clock: Clock = staticmethod(lambda: datetime.datetime.now(MOSCOW_TZ))
+    
+    def __init__(self, schedule: ChatSchedule, clock: Optional[Clock] = None):
+        self.schedule = schedule
+        if clock:
+            self.clock = clock
     
-    @staticmethod
-    def calculate_next_push_from_today(start_date: datetime.date) -> datetime.date:
+    @classmethod
+    def today(cls) -> datetime.date:
+        return cls.clock().date()
+    
+    @classmethod
+    def calculate_next_push_date(
+        cls,
+        start_date: datetime.date,
+        interval: int = PUSH_INTERVAL_DAYS,
+        today: Optional[datetime.date] = None,
+    ) -> datetime.date:
+        """Рассчитать следующую дату пуша (каждые interval дней), НО ТОЛЬКО В БУДУЩЕМ"""
+        return first_cycle_after(start_date, interval, today or cls.today())
+    
+    @classmethod
+    def calculate_next_push_from_today(
+        cls,
+        start_date: datetime.date,
+        interval: int = PUSH_INTERVAL_DAYS,
+        today: Optional[datetime.date] = None,
+    ) -> datetime.date:
         """Рассчитать следующую дату пуша, начиная с СЕГОДНЯ"""
-        today = datetime.date.today()
-        
-        # Если стартовая дата в будущем - возвращаем ее
-        if start_date > today:
-            return start_date
-        
-        # Находим, когда будет следующий пуш от стартовой даты
-        days_since_start = (today - start_date).days
-        # Сколько полных циклов прошло
-        cycles = days_since_start // PUSH_INTERVAL_DAYS
-        # Следующий цикл
-        next_date = start_date + datetime.timedelta(days=(cycles + 1) * PUSH_INTERVAL_DAYS)
-        
-        # Убеждаемся, что дата в будущем
-        while next_date <= today:
-            next_date += datetime.timedelta(days=PUSH_INTERVAL_DAYS)
-        
-        return next_date
+        return cls.calculate_next_push_date(start_date, interval, today)
+    
+    @classmethod
+    def project_calendar(
+        cls, schedules: Iterable[ChatSchedule], days: int, start: Optional[datetime.date] = None
+    ) -> PushCalendar:
+        """Сколько пушей и напоминаний придётся на каждый из ближайших days дней"""
+        return project_calendar(schedules, start or cls.today(), days)
+    
+    @classmethod
+    def project_push_dates(
+        cls, schedules: Iterable[ChatSchedule], days: int, start: Optional[datetime.date] = None
+    ) -> Dict[int, List[datetime.date]]:
+        """Даты пушей каждого чата на ближайшие days дней"""
+        return project_push_dates(schedules, start or cls.today(), days)
+    
+    @classmethod
+    def for_chat(cls, chat_id: int) -> 'PushScheduler':
+        """Расписание конкретного чата"""
+        return cls(bot_data.get_schedule(chat_id))
+    
+    def now(self) -> datetime.datetime:
+        return self.clock()
     
-    @staticmethod
-    def is_push_today() -> bool:
+    def next_push_date(self) -> datetime.date:
+        """Дата следующего пуша чата"""
+        return self.schedule.next_push_date(self.now())
+    
+    def is_push_today(self) -> bool:
         """Проверить, является ли сегодня днем пуша"""
-        if not bot_data.next_push_date:
-            return False
-        return bot_data.next_push_date == datetime.date.today()
+        return self.next_push_date() == self.now().date()
     
-    @staticmethod
-    def is_push_tomorrow() -> bool:
+    def is_push_tomorrow(self) -> bool:
         """Проверить, является ли завтра днем пуша"""
-        if not bot_data.next_push_date:
-            return False
-        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
-        return bot_data.next_push_date == tomorrow
+        tomorrow = self.now().date() + datetime.timedelta(days=1)
+        return self.next_push_date() == tomorrow
     
-    @staticmethod
-    def days_until_next_push() -> int:
+    def days_until_next_push(self) -> int:
         """Количество дней до следующего пуша"""
-        if not bot_data.next_push_date:
-            return -1
-        return (bot_data.next_push_date - datetime.date.today()).days
+        return (self.next_push_date() - self.now().date()).days
+    
+    def upcoming_push_dates(self, days: int) -> List[datetime.date]:
+        """Даты пушей чата на ближайшие days дней"""
+        return self.schedule.push_dates(self.now().date(), days)
 
 # Команды бота
+@instrument_handler('start')
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /start"""
     chat_id = update.effective_chat.id
-    bot_data.add_chat(chat_id)
-    
-    # Если дата не установлена или в прошлом - устанавливаем на завтра
-    if not bot_data.next_push_date or bot_data.next_push_date <= datetime.date.today():
-        bot_data.next_push_date = datetime.date.today() + datetime.timedelta(days=1)
-        bot_data.save_data()
-    
-    keyboard = [
-        [
-            InlineKeyboardButton("⚡ Подготовка пуша", callback_data="prepare_push"),
-            InlineKeyboardButton("🚀 Отправка пуша", callback_data="send_push"),
-        ],
-        [
-            InlineKeyboardButton("📊 Статистика", callback_data="stats"),
-            InlineKeyboardButton("📅 Следующий пуш", callback_data="next_push"),
-        ],
-        [
-            InlineKeyboardButton("🛠 Установить дату", callback_data="set_date"),
-        ],
-    ]
-    
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="🤖 Бот-напоминалка о пушах\n\nВыберите действие:",
-        reply_markup=reply_markup,
-    )
-    logger.info(f"Бот запущен в чате {chat_id}")
+    if bot_data.add_chat(chat_id):
+        # Новый чат получает собственное расписание
+        bot_data.save_schedule(bot_data.get_schedule(chat_id))
+    
+    await context.bot.send_message(chat_id=chat_id, text=MAIN_MENU_TEXT, reply_markup=MAIN_MENU)
+    logger.info("Бот запущен в чате %s", chat_id)
 
+@instrument_handler('button_handler')
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик нажатий на кнопки"""
+    """Обработчик нажатий на кнопки: ответ показывается на месте меню"""
     query = update.callback_query
-    await query.answer()
-    
     chat_id = update.effective_chat.id
     action = query.data
     
-    if action == "prepare_push":
-        # Проверяем, действительно ли завтра пуш
-        if PushScheduler.is_push_tomorrow():
-            await send_prepare_reminder(chat_id, context, manual=True)
-        else:
-            next_push = bot_data.next_push_date if bot_data.next_push_date else "не установлена"
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=f"⚠️ Завтра НЕ пуш!\nСледующий пуш: {next_push}"
+    if action in ("prepare_push", "send_push"):
+        # Проверяем, действительно ли завтра (сегодня) пуш
+        push_scheduler = PushScheduler.for_chat(chat_id)
+        due = push_scheduler.is_push_tomorrow() if action == "prepare_push" else push_scheduler.is_push_today()
+        if not due:
+            # Предупреждение всплывающим окном: одним вызовом, без правки меню
+            day = "Завтра" if action == "prepare_push" else "Сегодня"
+            await query.answer(
+                f"⚠️ {day} НЕ пуш!\nСледующий пуш: {push_scheduler.next_push_date()}", show_alert=True
             )
+            logger.info("Кнопка %s нажата в чате %s", action, chat_id)
+            return
+    
+    await query.answer()
+    
+    if action == "prepare_push":
+        await show_in_menu(query, MANUAL_TEXTS[PREPARE])
     
     elif action == "send_push":
-        # Проверяем, действительно ли сегодня пуш
-        if PushScheduler.is_push_today():
-            await send_push_day_reminder(chat_id, context, manual=True)
-        else:
-            next_push = bot_data.next_push_date if bot_data.next_push_date else "не установлена"
-            await context.bot.send_message(
-                chat_id=chat_id,
-                text=f"⚠️ Сегодня НЕ пуш!\nСледующий пуш: {next_push}"
-            )
+        await show_in_menu(query, MANUAL_TEXTS[PUSH_DAY])
     
     elif action == "stats":
-        await send_stats_reminder(chat_id, context, manual=True)
+        await show_in_menu(query, MANUAL_TEXTS[DAILY_STATS])
     
     elif action == "next_push":
-        await show_next_push_date(chat_id, context)
+        await show_in_menu(query, next_push_text(chat_id))
     
     elif action == "set_date":
-        await request_new_date(chat_id, context)
+        await request_new_date(query)
+    
+    elif action == "notifications":
+        await show_in_menu(query, NOTIFICATIONS_TEXT, notifications_keyboard(bot_data.get_schedule(chat_id).muted))
     
-    logger.info(f"Кнопка {action} нажата в чате {chat_id}")
+    elif action.startswith("mute:"):
+        kind = action.split(":", 1)[1]
+        if kind in REMINDER_LABELS:
+            schedule = bot_data.get_schedule(chat_id)
+            schedule.toggle_muted(kind)
+            bot_data.save_schedule(schedule)
+            await query.edit_message_reply_markup(reply_markup=notifications_keyboard(schedule.muted))
+    
+    elif action == "menu":
+        # Вернулись в меню, не введя дату - больше её не ждём
+        bot_data.prompts.discard(chat_id, query.from_user.id)
+        await show_in_menu(query, MAIN_MENU_TEXT, MAIN_MENU)
+    
+    logger.info("Кнопка %s нажата в чате %s", action, chat_id)
+
+async def show_in_menu(
+    query: CallbackQuery,
+    text: str,
+    reply_markup: Optional[InlineKeyboardMarkup] = None,
+    parse_mode: Optional[str] = None,
+) -> None:
+    """Заменить сообщение с меню ответом на нажатие (по умолчанию с кнопкой «Назад»)"""
+    reply_markup = reply_markup or BACK_TO_MENU
+    message = query.message
+    if message and message.text == text and message.reply_markup == reply_markup:
+        # Повторное нажатие той же кнопки: на экране уже нужный ответ
+        return
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+    except BadRequest as e:
+        # Текст с разметкой не сравнить с message.text - Telegram отвечает сам
+        if 'message is not modified' not in e.message.lower():
+            raise
 
-async def send_prepare_reminder(chat_id: int, context: ContextTypes.DEFAULT_TYPE, manual: bool = False) -> None:
+@functools.lru_cache(maxsize=None)
+def notifications_keyboard(muted: Tuple[str, ...]) -> InlineKeyboardMarkup:
+    """Переключатели подписки на каждый тип напоминаний и кнопка «Назад»"""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(
+            f"{'🔕' if kind in muted else '✅'} {label}", callback_data=f"mute:{kind}"
+        )]
+        for kind, label in REMINDER_LABELS.items()
+    ] + [[BACK_BUTTON]])
+
+async def send_prepare_reminder(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправить напоминание о подготовке пуша"""
-    message = "⚡ Завтра пуш! Не забудь подготовить сообщения 📝"
-    if manual:
-        message = "🔔 Ручное напоминание:\n" + message
-    
+    message = REMINDER_TEXTS[PREPARE]
     await context.bot.send_message(chat_id=chat_id, text=message)
-    logger.info(f"Напоминание о подготовке отправлено в чат {chat_id}")
+    chat_detail(logger, "Напоминание о подготовке отправлено в чат %s", chat_id, chat_id=chat_id)
 
-async def send_push_day_reminder(chat_id: int, context: ContextTypes.DEFAULT_TYPE, manual: bool = False) -> None:
+async def send_push_day_reminder(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправить напоминание в день пуша"""
-    message = "🚀 Пора отправлять пуш! 🔔"
-    if manual:
-        message = "🔔 Ручное напоминание:\n" + message
-    
+    message = REMINDER_TEXTS[PUSH_DAY]
     await context.bot.send_message(chat_id=chat_id, text=message)
     
-    # После пуша рассчитываем следующую дату
-    if not manual:
-        if bot_data.next_push_date:
-            bot_data.next_push_date = PushScheduler.calculate_next_push_from_today(bot_data.next_push_date)
-            bot_data.save_data()
-            logger.info(f"Новая дата пуша после отправки: {bot_data.next_push_date}")
-    
-    logger.info(f"Напоминание о пуше отправлено в чат {chat_id}")
+    chat_detail(logger, "Напоминание о пуше отправлено в чат %s", chat_id, chat_id=chat_id)
 
-async def send_stats_reminder(chat_id: int, context: ContextTypes.DEFAULT_TYPE, manual: bool = False) -> None:
+async def send_stats_reminder(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправить напоминание о статистике"""
-    message = "📈 Проверь статистику рассылки по неподтвержденным почтам!"
-    if manual:
-        message = "🔔 Ручное напоминание:\n" + message
-    
+    message = REMINDER_TEXTS[DAILY_STATS]
     await context.bot.send_message(chat_id=chat_id, text=message)
-    logger.info(f"Напоминание о статистике отправлено в чат {chat_id}")
+    chat_detail(logger, "Напоминание о статистике отправлено в чат %s", chat_id, chat_id=chat_id)
 
 async def send_weekly_push_reminder(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Отправить еженедельное напоминание"""
-    message = "💰 Пуш по тем, кто начал зарабатывать. Проверь рассылку 📊"
+    message = REMINDER_TEXTS[WEEKLY_PUSH]
     await context.bot.send_message(chat_id=chat_id, text=message)
-    logger.info(f"Еженедельное напоминание отправлено в чат {chat_id}")
+    chat_detail(logger, "Еженедельное напоминание отправлено в чат %s", chat_id, chat_id=chat_id)
 
-async def show_next_push_date(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Показать дату следующего пуша"""
-    if not bot_data.next_push_date:
-        bot_data.next_push_date = datetime.date.today() + datetime.timedelta(days=1)
-        bot_data.save_data()
-    
-    days_left = PushScheduler.days_until_next_push()
+async def send_digest(chat_id: int, context: ContextTypes.DEFAULT_TYPE, kinds: List[str]) -> None:
+    """Отправить несколько совпавших напоминаний одним сообщением"""
+    message = "\n\n".join(REMINDER_TEXTS[kind] for kind in kinds)
+    await context.bot.send_message(chat_id=chat_id, text=message)
+    chat_detail(logger, "Дайджест %s отправлен в чат %s", '+'.join(kinds), chat_id, chat_id=chat_id)
+
+def next_push_text(chat_id: int) -> str:
+    """Текст с датой следующего пуша; недолго кешируется для повторных нажатий"""
+    today = PushScheduler.today()
+    cached = next_push_texts.get(chat_id)
+    if cached and cached[0] > time.monotonic() and cached[1] == today:
+        return cached[2]
     
-    if days_left < 0:
-        # Если дата в прошлом, исправляем
-        bot_data.next_push_date = datetime.date.today() + datetime.timedelta(days=1)
-        bot_data.save_data()
-        days_left = 1
+    push_scheduler = PushScheduler.for_chat(chat_id)
+    next_push = push_scheduler.next_push_date()
+    days_left = push_scheduler.days_until_next_push()
     
     if days_left == 0:
-        message = f"🎯 Следующий пуш СЕГОДНЯ! ({bot_data.next_push_date})"
+        message = f"🎯 Следующий пуш СЕГОДНЯ! ({next_push})"
     elif days_left == 1:
-        message = f"📅 Следующий пуш ЗАВТРА! ({bot_data.next_push_date})"
+        message = f"📅 Следующий пуш ЗАВТРА! ({next_push})"
     else:
-        message = f"📅 Следующий пуш через {days_left} дней ({bot_data.next_push_date})"
+        message = f"📅 Следующий пуш через {days_left} дней ({next_push})"
     
-    await context.bot.send_message(chat_id=chat_id, text=message)
-    logger.info(f"Дата следующего пуша показана в чате {chat_id}")
-
-async def request_new_date(chat_id: int, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Запросить новую дату у пользователя"""
-    await context.bot.send_message(
-        chat_id=chat_id,
-        text="📝 Введите новую дату начала пушей в формате:\n"
-             "`ГГГГ-ММ-ДД`\n"
-             "Например: `2026-01-19`\n\n"
-             "❗ Дата должна быть в БУДУЩЕМ!",
-        parse_mode='Markdown'
-    )
-    context.user_data['waiting_for_date'] = True
-    logger.info(f"Запрос даты отправлен в чат {chat_id}")
+    next_push_texts[chat_id] = (time.monotonic() + NEXT_PUSH_CACHE_TTL, today, message)
+    logger.debug("Дата следующего пуша посчитана для чата %s", chat_id)
+    return message
+
+async def request_new_date(query: CallbackQuery) -> None:
+    """Запросить новую дату у нажавшего кнопку"""
+    chat_id = query.message.chat.id
+    await show_in_menu(query, DATE_PROMPT_TEXT, parse_mode='Markdown')
+    bot_data.prompts.add(chat_id, query.from_user.id)
+    logger.info("Запрос даты отправлен в чат %s", chat_id)
 
+def validate_schedule_input(start_date: str, interval: int) -> Tuple[datetime.date, int]:
+    """Проверить дату начала ГГГГ-ММ-ДД и интервал пушей, ValueError при ошибке"""
+    new_date = datetime.datetime.strptime(start_date, "%Y-%m-%d").date()
+    if not 1 <= interval <= MAX_INTERVAL_DAYS:
+        raise ValueError(f"интервал вне 1-{MAX_INTERVAL_DAYS}: {interval}")
+    return new_date, interval
+
+@instrument_handler('handle_date_input')
 async def handle_date_input(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Обработчик ввода даты"""
-    if not context.user_data.get('waiting_for_date'):
-        return
-    
+    """Обработчик ввода даты (сюда доходят только ответы на запрос даты)"""
     chat_id = update.effective_chat.id
+    user_id = update.effective_user.id
     date_text = update.message.text.strip()
     
     try:
-        new_date = datetime.datetime.strptime(date_text, "%Y-%m-%d").date()
-        today = datetime.date.today()
+        parts = date_text.split()
+        if not 1 <= len(parts) <= 2:
+            raise ValueError(date_text)
+        new_date, interval = validate_schedule_input(
+            parts[0], int(parts[1]) if len(parts) == 2 else bot_data.config.interval_days
+        )
+        today = PushScheduler.today()
         
         if new_date <= today:
             await update.message.reply_text(
@@ -319,173 +587,808 @@ async def handle_date_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
                 f"Введите дату начиная с завтрашнего дня.",
                 parse_mode='Markdown'
             )
-            logger.warning(f"Попытка установить прошедшую дату: {new_date} в чате {chat_id}")
+            logger.warning("Попытка установить прошедшую дату: %s в чате %s", new_date, chat_id)
             return
         
-        # Устанавливаем новую дату
-        bot_data.next_push_date = new_date
-        bot_data.save_data()
-        
-        # Перепланируем задания
-        await reschedule_jobs(context.application)
+        # Устанавливаем новую дату и перепланируем только этот чат
+        schedule = bot_data.get_schedule(chat_id)
+        schedule.start_date = new_date
+        schedule.interval_days = interval
+        # Интервал, введённый явно, больше не следует за конфигом
+        schedule.own_interval_days = len(parts) == 2
+        bot_data.save_schedule(schedule)
         
         # Рассчитываем следующую дату от новой
-        next_date = PushScheduler.calculate_next_push_from_today(new_date)
+        next_date = PushScheduler(schedule).next_push_date()
         
         await update.message.reply_text(
             f"✅ Новая дата пуша установлена: `{new_date}`\n"
+            f"Интервал: {interval} дн.\n"
             f"Следующий пуш: `{next_date}`\n\n"
             f"📅 Расписание:\n"
             f"• Завтра пуш: {next_date == today + datetime.timedelta(days=1)}\n"
             f"• Сегодня пуш: {new_date == today}",
             parse_mode='Markdown'
         )
-        logger.info(f"Новая дата пуша установлена: {new_date} в чате {chat_id}")
+        logger.info("Новая дата пуша установлена: %s в чате %s", new_date, chat_id)
         
     except ValueError:
         await update.message.reply_text(
             "❌ Неверный формат даты!\n"
-            "Используйте: `ГГГГ-ММ-ДД`\n"
+            f"Используйте: `ГГГГ-ММ-ДД` и, по желанию, интервал 1-{MAX_INTERVAL_DAYS} дней\n"
             "Пример: `2026-01-19`",
             parse_mode='Markdown'
         )
-        logger.warning(f"Неверный формат даты: {date_text} в чате {chat_id}")
+        logger.warning("Неверный формат даты: %s в чате %s", date_text, chat_id)
     
-    context.user_data['waiting_for_date'] = False
+    bot_data.prompts.discard(chat_id, user_id)
 
-async def schedule_daily_tasks(application: Application) -> None:
-    """Запланировать ежедневные задачи"""
+def cron_trigger(job: CronJob) -> CronTrigger:
+    return CronTrigger(
+        day_of_week=job.day_of_week, hour=job.time.hour, minute=job.time.minute, timezone=MOSCOW_TZ
+    )
+
+def apply_schedule_config(application: Application, config: ScheduleConfig) -> List[str]:
+    """Привести живые задачи к конфигу, трогая только изменившиеся.
+    
+    Возвращает список изменений: +добавлена, ~изменена, -удалена.
+    """
+    unknown = {job.kind for job in config.jobs.values()} - CRON_SENDERS.keys()
+    if unknown:
+        raise ValueError(f"Неизвестные типы рассылок: {', '.join(sorted(unknown))}")
+    if bot_data.scheduler is None:
+        # Процесс не лидер: конфиг применится, когда он получит аренду
+        bot_data.config = config
+        return []
+    changes = []
+    scheduler = bot_data.scheduler
+    for job_id in bot_data.cron_jobs.keys() - config.jobs.keys():
+        scheduler.remove_job(job_id)
+        job_store.forget(job_id)
+        changes.append(f"-{job_id}")
+    for job_id, job in config.jobs.items():
+        current = bot_data.cron_jobs.get(job_id)
+        if current == job:
+            continue
+        if current is None:
+            scheduler.add_job(
+                run_cron_job,
+                cron_trigger(job),
+                args=[application, job_id],
+                id=job_id,
+                misfire_grace_time=300
+            )
+            changes.append(f"+{job_id}")
+        else:
+            # run_cron_job берёт тип и время из bot_data.cron_jobs, меняется только триггер
+            if (current.time, current.day_of_week) != (job.time, job.day_of_week):
+                scheduler.reschedule_job(job_id, trigger=cron_trigger(job))
+            changes.append(f"~{job_id}")
+    bot_data.cron_jobs = dict(config.jobs)
+    
+    old = bot_data.config
+    if (old.prepare_times, old.push_time) != (config.prepare_times, config.push_time):
+        changes.append("~reminder_times")
+    if old.interval_days != config.interval_days:
+        changes.append("~interval_days")
+    bot_data.config = config
+    if old.interval_days != config.interval_days or "~reminder_times" in changes:
+        # Чаты со своими настройками не трогаем, остальные перепланируем на новые значения
+        if bot_data.push_scheduler:
+            bot_data.push_scheduler.retime(config.prepare_times, config.push_time, config.interval_days)
+        next_push_texts.clear()
+    return changes
+
+async def reload_schedule(application: Application) -> List[str]:
+    """Перечитать файл расписаний и применить разницу"""
+    mtime = schedule_file_mtime()
+    config = load_schedule_config(SCHEDULE_FILE, interval_days=PUSH_INTERVAL_DAYS)
+    changes = apply_schedule_config(application, config)
+    bot_data.config_mtime = mtime
+    logger.info("Расписания перечитаны из %s: %s", SCHEDULE_FILE, ', '.join(changes) or 'без изменений')
+    return changes
+
+@instrument_handler('reload')
+async def reload_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Команда /reload для администраторов: перечитать расписания"""
+    try:
+        if bot_data.scheduler is None:
+            # Задачи ведёт другой воркер: здесь только проверяем файл, применит его лидер
+            load_schedule_config(SCHEDULE_FILE, interval_days=PUSH_INTERVAL_DAYS)
+            await update.message.reply_text(
+                f"ℹ️ Воркер {WORKER_ID} не ведёт расписания, здесь ничего не изменилось. "
+                f"Лидер перечитает {SCHEDULE_FILE} сам в течение {LEASE_TTL_SECONDS / 3:.0f} с после изменения файла."
+            )
+            return
+        changes = await reload_schedule(context.application)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ Конфиг не применён: {e}")
+        return
+    await update.message.reply_text(f"✅ Расписания обновлены: {', '.join(changes) or 'без изменений'}")
+
+def missed_runs(job: CronJob, last_run: datetime.datetime, now: datetime.datetime) -> List[datetime.datetime]:
+    """Запуски cron-задачи после last_run, наступившие к now (не больше MAX_CATCH_UP_RUNS последних)"""
+    trigger = cron_trigger(job)
+    step = datetime.timedelta(microseconds=1)
+    runs: List[datetime.datetime] = []
+    fire_at = trigger.get_next_fire_time(None, last_run + step)
+    while fire_at is not None and fire_at <= now:
+        runs.append(fire_at)
+        fire_at = trigger.get_next_fire_time(fire_at, fire_at + step)
+    return runs[-MAX_CATCH_UP_RUNS:]
+
+def catch_up_cron_jobs(application: Application) -> None:
+    """Запустить cron-задачи, пропущенные, пока бот был выключен"""
+    now = PushScheduler.clock()
+    grace = datetime.timedelta(seconds=MISFIRE_GRACE_SECONDS)
+    for job_id, job in bot_data.cron_jobs.items():
+        last_run = job_store.get_last_run(job_id)
+        if last_run is None:
+            continue
+        runs = missed_runs(job, last_run, now)
+        if CATCH_UP_POLICY == CATCH_UP_SKIP:
+            runs = [fire_at for fire_at in runs if now - fire_at <= grace]
+        elif CATCH_UP_POLICY != CATCH_UP_RUN_ONCE:
+            runs = runs[-1:]
+        if runs:
+            application.create_task(catch_up_cron_job(application, job_id, runs))
+
+async def catch_up_cron_job(application: Application, job_id: str, runs: List[datetime.datetime]) -> None:
+    """Пропущенные запуски по очереди: отметка не должна обогнать незаписанный запуск"""
+    for fire_at in runs:
+        logger.warning("Догоняющий запуск %s за %s", job_id, fire_at)
+        await run_cron_job(application, job_id, fire_at)
+
+async def start_push_scheduler() -> None:
+    """Загрузить расписания чатов с отметки прошлого запуска и запустить планировщик"""
+    await bot_data.push_scheduler.load_async(bot_data.iter_schedules(), since=job_store.get_last_run(DUE_JOB_ID))
+    bot_data.push_scheduler.start()
+
+async def start_leader_tasks(application: Application) -> None:
+    """Запустить задачи по расписанию: их ведёт только один процесс"""
+    # Пока лидером был другой процесс, отметки запусков в базе ушли вперёд
+    job_store.clear_cache()
     if not bot_data.scheduler:
         bot_data.scheduler = AsyncIOScheduler(timezone=MOSCOW_TZ)
     
-    # Напоминание за день до пуша (11:00, 19:00, 23:30) - только если завтра действительно пуш
-    reminders = [(11, 0), (19, 0), (23, 30)]
-    for hour, minute in reminders:
-        bot_data.scheduler.add_job(
-            check_and_send_prepare_reminder,
-            CronTrigger(hour=hour, minute=minute, timezone=MOSCOW_TZ),
-            args=[application],
-            id=f"prepare_{hour}_{minute}",
-            misfire_grace_time=300
+    # Напоминания за день до пуша и в день пуша идут по расписаниям чатов:
+    # планировщик просыпается только к ближайшему наступающему событию
+    if not bot_data.push_scheduler:
+        bot_data.push_scheduler = DueScheduler(
+            functools.partial(send_due_reminders, application),
+            MOSCOW_TZ,
+            catch_up=CATCH_UP_POLICY,
+            on_progress=lambda mark: job_store.set_last_run(DUE_JOB_ID, mark),
         )
+    # Напоминания, совпавшие по времени, уходят в чат одним сообщением
+    if not bot_data.digest:
+        bot_data.digest = DigestBuffer(functools.partial(send_reminder_digest, application), DIGEST_WINDOW)
     
-    # Напоминание в день пуша (10:00) - только если сегодня действительно пуш
-    bot_data.scheduler.add_job(
-        check_and_send_push_day_reminder,
-        CronTrigger(hour=10, minute=0, timezone=MOSCOW_TZ),
-        args=[application],
-        id="push_day_10_00",
-        misfire_grace_time=300
-    )
-    
-    # Ежедневная статистика (12:00)
-    bot_data.scheduler.add_job(
-        send_daily_stats_to_all,
-        CronTrigger(hour=12, minute=0, timezone=MOSCOW_TZ),
-        args=[application],
-        id="daily_stats_12_00",
-        misfire_grace_time=300
-    )
-    
-    # Еженедельные пуши (вторник 12:00)
-    bot_data.scheduler.add_job(
-        send_weekly_push_to_all,
-        CronTrigger(day_of_week="tue", hour=12, minute=0, timezone=MOSCOW_TZ),
-        args=[application],
-        id="weekly_push_tue_12_00",
-        misfire_grace_time=300
-    )
+    # Ежедневная статистика и еженедельные пуши - из конфига расписаний
+    apply_schedule_config(application, bot_data.config)
     
+    bot_data.scheduler.add_listener(on_job_submitted, EVENT_JOB_SUBMITTED)
     bot_data.scheduler.start()
+    catch_up_cron_jobs(application)
+    # Изменения расписаний от других процессов - начиная с этого момента
+    bot_data.change_seq = bot_data.storage.last_change()
+    # Расписания чатов грузятся в фоне: бот отвечает на команды сразу после старта
+    application.create_task(start_push_scheduler())
     logger.info("Ежедневные задачи запланированы")
 
-async def reschedule_jobs(application: Application) -> None:
-    """Перепланировать задания при изменении даты"""
+def stop_leader_tasks() -> None:
+    """Остановить задачи по расписанию, когда аренда лидера потеряна"""
     if bot_data.scheduler:
-        bot_data.scheduler.remove_all_jobs()
-        await schedule_daily_tasks(application)
-        logger.info("Задания перепланированы")
-
-async def check_and_send_prepare_reminder(application: Application) -> None:
-    """Проверить и отправить напоминание за день до пуша"""
-    if not bot_data.next_push_date:
-        logger.warning("Дата пуша не установлена, пропускаем напоминание")
+        bot_data.scheduler.shutdown(wait=False)
+        bot_data.scheduler = None
+        bot_data.cron_jobs = {}
+    if bot_data.push_scheduler:
+        bot_data.push_scheduler.stop()
+        bot_data.push_scheduler = None
+
+def sync_schedule_changes() -> None:
+    """Подтянуть в планировщик лидера расписания, изменённые другими процессами"""
+    seq, chat_ids = bot_data.storage.changes_since(bot_data.change_seq)
+    if not chat_ids or not bot_data.push_scheduler:
         return
-    
-    # Проверяем, действительно ли завтра пуш
-    if PushScheduler.is_push_tomorrow():
-        logger.info(f"Завтра пуш ({bot_data.next_push_date}), отправляем напоминания")
-        for chat_id in bot_data.active_chats:
-            try:
-                await send_prepare_reminder(chat_id, application.bot)
-            except Exception as e:
-                logger.error(f"Ошибка отправки в чат {chat_id}: {e}")
+    for chat_id in chat_ids:
+        next_push_texts.pop(chat_id, None)
+        if bot_data.storage.has_chat(chat_id):
+            bot_data.push_scheduler.update(bot_data.get_schedule(chat_id))
+        else:
+            bot_data.push_scheduler.remove(chat_id)
+    bot_data.change_seq = seq
+    bot_data.storage.trim_changes(seq)
+    logger.info("Обновлены расписания %d чатов из других процессов", len(chat_ids))
+
+def owns_chat(chat_id: int) -> bool:
+    """Чат в шарде этого процесса"""
+    return WORKER_COUNT == 1 or ring.owner(chat_id) == WORKER_ID
+
+def poll_outbox(application: Application) -> None:
+    """Забрать свою долю рассылок, поставленных в outbox лидером"""
+    for job, run_date in outbox.pending_jobs():
+        key = (job, run_date)
+        if key not in delivering and key not in polled_jobs:
+            polled_jobs.add(key)
+            application.create_task(deliver_outbox(application, job, run_date))
+
+async def reload_if_changed(application: Application) -> None:
+    """Лидер перечитывает файл расписаний сам: /reload мог попасть к другому воркеру"""
+    mtime = schedule_file_mtime()
+    if mtime == bot_data.config_mtime:
+        return
+    try:
+        await reload_schedule(application)
+    except ValueError as e:
+        logger.error("Конфиг расписаний %s не применён: %s", SCHEDULE_FILE, e)
+    # Неверный файл не перечитываем на каждом шаге, ждём следующего изменения
+    bot_data.config_mtime = mtime
+
+async def run_worker(application: Application) -> None:
+    """Цикл воркера: продлевать аренду лидера и разбирать outbox"""
+    lease = LeaderLease(LEASE_FILE, 'scheduler', holder=f"{os.getpid()}:{WORKER_ID}", ttl=LEASE_TTL_SECONDS)
+    leader = False
+    try:
+        while True:
+            # Запрос даты мог уйти из другого процесса
+            bot_data.prompts.load()
+            if lease.acquire():
+                if not leader:
+                    leader = True
+                    logger.info("Воркер %d стал лидером", WORKER_ID)
+                    await start_leader_tasks(application)
+                sync_schedule_changes()
+                await reload_if_changed(application)
+            elif leader:
+                leader = False
+                logger.warning("Воркер %d потерял аренду лидера", WORKER_ID)
+                stop_leader_tasks()
+            poll_outbox(application)
+            # Продлеваем с запасом: аренда переходит к другому процессу не позже чем через ttl
+            await asyncio.sleep(LEASE_TTL_SECONDS / 3)
+    finally:
+        if leader:
+            stop_leader_tasks()
+            lease.release()
+        lease.close()
+
+async def schedule_daily_tasks(application: Application) -> None:
+    """Запланировать ежедневные задачи"""
+    global worker_task
+    # До догоняющих запусков: их строки за прошлые дни не должны попасть под expire
+    expire_outbox()
+    if WORKER_COUNT > 1:
+        # Бесконечный цикл не через application.create_task: stop() ждёт такие задачи
+        worker_task = asyncio.create_task(run_worker(application))
     else:
-        logger.info(f"Завтра не пуш, пропускаем напоминание. Следующий пуш: {bot_data.next_push_date}")
+        await start_leader_tasks(application)
+    
+    if hasattr(signal, 'SIGHUP'):
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGHUP, lambda: application.create_task(reload_schedule(application))
+            )
+        except NotImplementedError:
+            pass
+    
+    global metrics_server
+    if METRICS_PORT and not metrics_server:
+        metrics_server = MetricsServer(METRICS_HOST, METRICS_PORT)
+        await metrics_server.start()
+    
+    # Недоставленное до перезапуска дорассылаем в фоне, не задерживая старт
+    application.create_task(resume_outbox(application))
+
+# Типы рассылок
+DAILY_STATS = 'daily_stats'
+WEEKLY_PUSH = 'weekly_push'
+
+# Тексты напоминаний; в дайджесте они склеиваются в этом порядке
+REMINDER_TEXTS = {
+    PUSH_DAY: "🚀 Пора отправлять пуш! 🔔",
+    PREPARE: "⚡ Завтра пуш! Не забудь подготовить сообщения 📝",
+    DAILY_STATS: "📈 Проверь статистику рассылки по неподтвержденным почтам!",
+    WEEKLY_PUSH: "💰 Пуш по тем, кто начал зарабатывать. Проверь рассылку 📊",
+}
+REMINDER_ORDER = tuple(REMINDER_TEXTS)
 
-async def check_and_send_push_day_reminder(application: Application) -> None:
-    """Проверить и отправить напоминание в день пуша"""
-    if not bot_data.next_push_date:
-        logger.warning("Дата пуша не установлена, пропускаем напоминание")
+# Названия типов для настройки подписок
+REMINDER_LABELS = {
+    PUSH_DAY: "Отправка пуша",
+    PREPARE: "Подготовка пуша",
+    DAILY_STATS: "Статистика",
+    WEEKLY_PUSH: "Еженедельный пуш",
+}
+
+# Ручные напоминания из меню
+MANUAL_TEXTS = {kind: "🔔 Ручное напоминание:\n" + text for kind, text in REMINDER_TEXTS.items()}
+
+# Меню и статичные экраны собираются один раз при запуске
+MAIN_MENU_TEXT = "🤖 Бот-напоминалка о пушах\n\nВыберите действие:"
+MAIN_MENU = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("⚡ Подготовка пуша", callback_data="prepare_push"),
+        InlineKeyboardButton("🚀 Отправка пуша", callback_data="send_push"),
+    ],
+    [
+        InlineKeyboardButton("📊 Статистика", callback_data="stats"),
+        InlineKeyboardButton("📅 Следующий пуш", callback_data="next_push"),
+    ],
+    [
+        InlineKeyboardButton("🛠 Установить дату", callback_data="set_date"),
+        InlineKeyboardButton("🔕 Подписки", callback_data="notifications"),
+    ],
+])
+BACK_BUTTON = InlineKeyboardButton("⬅️ Назад", callback_data="menu")
+BACK_TO_MENU = InlineKeyboardMarkup([[BACK_BUTTON]])
+NOTIFICATIONS_TEXT = "🔕 Какие напоминания присылать в этот чат:"
+DATE_PROMPT_TEXT = (
+    "📝 Введите новую дату начала пушей в формате:\n"
+    "`ГГГГ-ММ-ДД`\n"
+    "Например: `2026-01-19`\n"
+    "Через пробел можно указать интервал в днях: `2026-01-19 4`\n\n"
+    "❗ Дата должна быть в БУДУЩЕМ!"
+)
+
+# Функция отправки для каждого типа рассылки
+BROADCAST_SENDERS = {
+    PREPARE: send_prepare_reminder,
+    PUSH_DAY: send_push_day_reminder,
+    DAILY_STATS: send_stats_reminder,
+    WEEKLY_PUSH: send_weekly_push_reminder,
+}
+
+def sender_for(kind: str):
+    """Функция отправки для строки outbox: один тип или склеенный дайджест"""
+    kinds = split_kinds(kind)
+    if len(kinds) == 1:
+        return BROADCAST_SENDERS[kind]
+    return functools.partial(send_digest, kinds=kinds)
+
+async def run_broadcast(
+    application: Application,
+    job: str,
+    run_date: datetime.date,
+    rows: Iterable[Tuple[int, str]],
+    events: Optional[Dict[str, str]] = None,
+) -> None:
+    """Записать рассылку (chat_id, kind) в outbox и доставить её"""
+    outbox.enqueue_rows(job, run_date, rows, events)
+    polled_jobs.add((job, run_date))
+    await deliver_outbox(application, job, run_date)
+
+async def deliver_outbox(application: Application, job: str, run_date: datetime.date) -> None:
+    """Доставить недоставленные строки рассылки, отмечая результат по каждому чату.
+    
+    Строка помечается после отправки, поэтому при падении между ними
+    сообщение может уйти повторно, но не потеряется.
+    """
+    key = (job, run_date)
+    if key in delivering:
+        logger.info("Рассылка %s за %s уже доставляется", job, run_date)
         return
+    delivering.add(key)
+    # Состав сообщения для чатов, которые сейчас в отправке
+    kinds: Dict[int, str] = {}
+    # Временные сбои в текущем проходе: их строки ждут повтора
+    transient = 0
     
-    # Проверяем, действительно ли сегодня пуш
-    if PushScheduler.is_push_today():
-        logger.info(f"Сегодня пуш ({bot_data.next_push_date}), отправляем напоминания")
-        for chat_id in bot_data.active_chats:
-            try:
-                await send_push_day_reminder(chat_id, application.bot)
-            except Exception as e:
-                logger.error(f"Ошибка отправки в чат {chat_id}: {e}")
-        
-        # После отправки пуша вычисляем следующую дату
-        bot_data.next_push_date = PushScheduler.calculate_next_push_from_today(bot_data.next_push_date)
-        bot_data.save_data()
-        logger.info(f"Следующая дата пуша: {bot_data.next_push_date}")
-    else:
-        logger.info(f"Сегодня не пуш, пропускаем напоминание. Следующий пуш: {bot_data.next_push_date}")
+    def deliverable() -> Iterator[int]:
+        for chat_id, kind in outbox.iter_pending(job, run_date):
+            if not owns_chat(chat_id):
+                continue
+            if chat_health.should_skip(chat_id):
+                outbox.mark_skipped(job, run_date, chat_id, 'backoff')
+                continue
+            kinds[chat_id] = kind
+            yield chat_id
+    
+    async def send(chat_id: int) -> None:
+        await sender_for(kinds[chat_id])(chat_id, application)
+    
+    def on_sent(chat_id: int) -> None:
+        kinds.pop(chat_id, None)
+        outbox.mark_sent(job, run_date, chat_id)
+        chat_health.record_success(chat_id)
+    
+    def on_failed(chat_id: int, e: Exception) -> None:
+        nonlocal transient
+        kind = kinds.pop(chat_id, None)
+        if classify_failure(e) == TRANSIENT:
+            # Чат ни при чём: строка остаётся в очереди до следующего прохода
+            transient += 1
+            outbox.mark_retry(job, run_date, chat_id, str(e))
+            return
+        outbox.mark_failed(job, run_date, chat_id, str(e))
+        handle_send_failure(kind, job, run_date, chat_id, e)
+    
+    try:
+        window = max((DISPATCH_WINDOWS.get(k, 0) for k in split_pending_kinds(job, run_date)), default=0)
+        retries = 0
+        while True:
+            transient = 0
+            stats = await broadcaster.run(
+                job, deliverable(), send, on_sent=on_sent, on_failed=on_failed,
+                window=window, expected=outbox.count_pending(job, run_date) // WORKER_COUNT,
+            )
+            # Строки, добавленные позади курсора (переехавшие группы), дорассылаем без окна
+            if not stats.total or not outbox.count_pending(job, run_date):
+                break
+            window = 0
+            if transient:
+                if retries >= DELIVERY_RETRIES:
+                    logger.warning(
+                        "Рассылка %s за %s: %d строк не доставлены после %d повторов",
+                        job, run_date, transient, retries,
+                    )
+                    break
+                retries += 1
+                await asyncio.sleep(DELIVERY_RETRY_DELAY * 2 ** (retries - 1))
+    finally:
+        delivering.discard(key)
+
+def split_pending_kinds(job: str, run_date: datetime.date) -> Set[str]:
+    """Отдельные типы напоминаний в недоставленных строках рассылки"""
+    return {kind for joined in outbox.pending_kinds(job, run_date) for kind in split_kinds(joined)}
+
+def handle_send_failure(kind: str, job: str, run_date: datetime.date, chat_id: int, e: Exception) -> None:
+    """Разобрать ошибку отправки: выключить мёртвый чат, перенести переехавший.
+    
+    Паузу и счётчик до выключения получают только ошибки по вине чата:
+    сбой Telegram или ошибка в коде не должны выключать живые чаты.
+    """
+    failure = classify_failure(e)
+    if failure == DEAD:
+        bot_data.deactivate_chat(chat_id, str(e))
+    elif failure == MIGRATED:
+        bot_data.migrate_chat(chat_id, e.new_chat_id)
+        # Строка для нового id попадёт в текущий обход outbox
+        outbox.enqueue(kind, job, run_date, [e.new_chat_id])
+    elif failure == CHAT:
+        chat_health.record_failure(chat_id)
+        if chat_health.is_exhausted(chat_id):
+            bot_data.deactivate_chat(chat_id, f"{chat_health.max_failures} ошибок подряд: {e}", cause=failure)
+
+def expire_outbox() -> None:
+    """Не дорассылать недоставленное за прошлые дни и удалить старые строки"""
+    today = PushScheduler.today()
+    expired = outbox.expire(before=today)
+    if expired:
+        logger.warning("Устаревших недоставленных сообщений: %d", expired)
+    outbox.purge(before=today - datetime.timedelta(days=OUTBOX_RETENTION_DAYS))
+
+async def resume_outbox(application: Application) -> None:
+    """Дорассылать то, что не успели доставить до перезапуска.
+    
+    Сюда попадают и рассылки, не дописанные в очередь: ставит их только лидер,
+    и недостающие строки допишет догоняющий запуск события.
+    """
+    for job, run_date in outbox.pending_jobs(ready_only=False):
+        logger.info("Возобновляем рассылку %s за %s", job, run_date)
+        polled_jobs.add((job, run_date))
+        await deliver_outbox(application, job, run_date)
+
+def lookup_schedule(chat_id: int) -> ChatSchedule:
+    """Расписание чата из памяти планировщика, без похода в хранилище"""
+    schedule = bot_data.push_scheduler.schedules.get(chat_id) if bot_data.push_scheduler else None
+    return schedule or bot_data.get_schedule(chat_id)
 
-async def send_daily_stats_to_all(application: Application) -> None:
+async def send_reminder_digest(
+    application: Application, fire_at: datetime.datetime, due: Due, sources: Sources
+) -> None:
+    """Разослать напоминания, собранные за окно дайджеста: одно сообщение на чат.
+    
+    Имя рассылки зависит от того, что попало в окно, поэтому от повторов
+    защищают ключи исходных событий: уже поставленное чату событие
+    (например, дорассылаемое после рестарта) из его строки выбрасывается.
+    """
+    job = f"{join_kinds(kind for kind in REMINDER_ORDER if kind in due)}_{fire_at:%H_%M}"
+    rows = compose_digest(due, REMINDER_ORDER, bot_data.iter_schedules, lookup_schedule)
+    events = {kind: event_key(kind, planned) for kind, planned in sources.items()}
+    await run_broadcast(application, job, fire_at.date(), rows, events)
+
+def scheduled_at(run_time: datetime.time) -> datetime.datetime:
+    """Плановое время сегодняшнего запуска cron-задачи"""
+    return MOSCOW_TZ.localize(datetime.datetime.combine(PushScheduler.today(), run_time))
+
+@instrument_job('due_reminders')
+async def send_due_reminders(
+    application: Application, kind: str, fire_at: datetime.datetime, chat_ids: List[int]
+) -> None:
+    """Разослать напоминания чатам, у которых наступило событие расписания"""
+    record_scheduler_lag(kind, fire_at)
+    logger.info("Событие %s в %s: %d чатов", kind, fire_at, len(chat_ids))
+    await collect_reminder(application, kind, fire_at, chat_ids)
+
+async def collect_reminder(
+    application: Application, kind: str, fire_at: datetime.datetime, chat_ids: Optional[List[int]]
+) -> None:
+    """Отдать напоминание в дайджест; догоняющий запуск рассылается отдельно.
+    
+    Пропущенные запуски (старше misfire grace) идут подряд, и в общем окне
+    они схлопнулись бы в один - при run_once каждый должен уйти сам.
+    """
+    if PushScheduler.clock() - fire_at > datetime.timedelta(seconds=MISFIRE_GRACE_SECONDS):
+        await send_reminder_digest(application, fire_at, {kind: chat_ids}, {kind: fire_at})
+        return
+    await bot_data.digest.add(kind, fire_at, chat_ids)
+
+@instrument_job(DAILY_STATS)
+async def send_daily_stats_to_all(
+    application: Application, run_time: datetime.time, fire_at: Optional[datetime.datetime] = None
+) -> None:
     """Отправить ежедневное напоминание о статистике всем"""
     logger.info("Отправка ежедневной статистики")
-    for chat_id in bot_data.active_chats:
-        try:
-            await send_stats_reminder(chat_id, application.bot)
-        except Exception as e:
-            logger.error(f"Ошибка отправки в чат {chat_id}: {e}")
+    await collect_reminder(application, DAILY_STATS, fire_at or scheduled_at(run_time), None)
 
-async def send_weekly_push_to_all(application: Application) -> None:
+@instrument_job(WEEKLY_PUSH)
+async def send_weekly_push_to_all(
+    application: Application, run_time: datetime.time, fire_at: Optional[datetime.datetime] = None
+) -> None:
     """Отправить еженедельное напоминание всем"""
     logger.info("Отправка еженедельного напоминания")
-    for chat_id in bot_data.active_chats:
+    await collect_reminder(application, WEEKLY_PUSH, fire_at or scheduled_at(run_time), None)
+
+# Задача cron для каждого типа рассылки всем чатам
+CRON_SENDERS = {
+    DAILY_STATS: send_daily_stats_to_all,
+    WEEKLY_PUSH: send_weekly_push_to_all,
+}
+
+async def run_cron_job(
+    application: Application, job_id: str, fire_at: Optional[datetime.datetime] = None
+) -> None:
+    """Запуск cron-задачи из конфига.
+    
+    Отметка последнего запуска ставится, когда рассылка уже записана в outbox:
+    если процесс упадёт раньше, запуск догонится после рестарта.
+    """
+    job = bot_data.cron_jobs[job_id]
+    fire_at = fire_at or scheduled_at(job.time)
+    await CRON_SENDERS[job.kind](application, job.time, fire_at=fire_at)
+    # Задачу могли убрать из конфига, пока шла рассылка
+    if job_id in bot_data.cron_jobs:
+        job_store.set_last_run(job_id, fire_at)
+
+async def shutdown(application: Application) -> None:
+    """Завершение работы: сбросить состояние на диск"""
+    if worker_task:
+        worker_task.cancel()
         try:
-            await send_weekly_push_reminder(chat_id, application.bot)
-        except Exception as e:
-            logger.error(f"Ошибка отправки в чат {chat_id}: {e}")
+            await worker_task
+        except asyncio.CancelledError:
+            pass
+    stop_leader_tasks()
+    job_store.close()
+    if metrics_server:
+        await metrics_server.stop()
+    await bot_data.close()
+    outbox.close()
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик ошибок"""
-    logger.error(f"Ошибка: {context.error}", exc_info=context.error)
+    logger.error("Ошибка: %s", context.error, exc_info=context.error)
 
-def main() -> None:
-    """Основная функция запуска бота"""
+# Какие типы обновлений нужны каждому виду обработчика
+HANDLER_UPDATE_TYPES = {
+    CommandHandler: [Update.MESSAGE],
+    MessageHandler: [Update.MESSAGE],
+    CallbackQueryHandler: [Update.CALLBACK_QUERY],
+}
+
+def allowed_update_types(application: Application) -> List[str]:
+    """Типы обновлений, которые реально обрабатываются зарегистрированными обработчиками"""
+    types = set()
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            types.update(HANDLER_UPDATE_TYPES.get(type(handler), Update.ALL_TYPES))
+    return sorted(types)
+
+class ListenOnlyUpdater(Updater):
+    """Updater, который принимает вебхук, но не трогает его настройки в Telegram.
     
-    # Создаем приложение
-    application = Application.builder().token(TOKEN).build()
+    Без webhook_url PTB сам сочиняет адрес из listen и порта и регистрирует его,
+    поэтому у воркеров кроме нулевого шаг bootstrap пропускается целиком.
+    """
+    __slots__ = ()
     
-    # Добавляем обработчики
+    async def _bootstrap(self, *args, **kwargs) -> None:
+        pass
+
+def run_webhook(application: Application, allowed_updates: List[str]) -> None:
+    """Получать обновления через встроенный HTTP-сервер вебхука.
+    
+    Вебхук у Telegram регистрирует только воркер 0, остальные лишь слушают свой порт.
+    Очередь обновлений сбрасывается только у одиночного воркера: при нескольких
+    рестарт одного из них не должен терять обновления, адресованные остальным.
+    """
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL не установлен для режима webhook")
+    if not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET не установлен для режима webhook")
+    
+    port = WEBHOOK_PORT + WORKER_ID
+    registers = WORKER_ID == 0
+    logger.info("Вебхук слушает порт %d, регистрирует вебхук: %s", port, registers)
+    if not registers:
+        application.updater = ListenOnlyUpdater(application.bot, application.update_queue)
+    # Telegram передаёт secret_token в заголовке, запросы без него отклоняются
+    application.run_webhook(
+        listen=WEBHOOK_LISTEN,
+        port=port,
+        url_path=WEBHOOK_PATH,
+        webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        drop_pending_updates=WORKER_COUNT == 1,
+        allowed_updates=allowed_updates,
+    )
+
+def add_handlers(application: Application) -> None:
+    """Зарегистрировать обработчики обновлений"""
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("reload", reload_command, filters=filters.User(user_id=ADMIN_IDS)))
     application.add_handler(CallbackQueryHandler(button_handler))
+    # Текст без запроса даты отсекается фильтром, не запуская обработчик
     application.add_handler(
-        MessageHandler(filters.TEXT & ~filters.COMMAND, handle_date_input)
+        MessageHandler(
+            filters.TEXT & ~filters.COMMAND & AwaitingDate(lambda: bot_data.prompts), handle_date_input
+        )
     )
     application.add_error_handler(error_handler)
+
+def export_chats(out: TextIO) -> int:
+    """Выгрузить активные чаты с расписаниями в JSONL, по строке на чат"""
+    count = 0
+    for chat_id, data in bot_data.storage.iter_schedules():
+        out.write(json.dumps({'chat_id': chat_id, **(data or {})}, ensure_ascii=False) + "\n")
+        count += 1
+    logger.info("Выгружено чатов: %d", count)
+    return count
+
+def parse_chat_line(line: str) -> Tuple[int, Optional[dict]]:
+    """Разобрать строку JSONL: chat_id и, если указана start_date, расписание чата"""
+    data = json.loads(line)
+    if not isinstance(data, dict):
+        raise ValueError("ожидался объект")
+    chat_id = data['chat_id']
+    if not isinstance(chat_id, int) or isinstance(chat_id, bool):
+        raise ValueError(f"неверный chat_id: {chat_id!r}")
+    if 'start_date' not in data:
+        return chat_id, None
+    interval = data.get('interval_days', bot_data.config.interval_days)
+    if not isinstance(interval, int) or isinstance(interval, bool):
+        raise ValueError(f"неверный interval_days: {interval!r}")
+    # Те же правила, что при вводе даты в чате; дата в прошлом допустима -
+    # от неё считается цикл уже идущих пушей
+    start_date, interval = validate_schedule_input(data['start_date'], interval)
+    muted = tuple(data.get('muted', ()))
+    unknown = [kind for kind in muted if kind not in REMINDER_LABELS]
+    if unknown:
+        raise ValueError(f"неизвестные типы напоминаний: {unknown}")
+    schedule = ChatSchedule(
+        chat_id, start_date, interval_days=interval, muted=muted, own_interval_days='interval_days' in data
+    )
+    # Своё время напоминаний чата переносится как есть, формат ЧЧ:ММ
+    if 'prepare_times' in data:
+        schedule.prepare_times = tuple(parse_time(t) for t in data['prepare_times'])
+        schedule.own_prepare_times = True
+    if 'push_time' in data:
+        schedule.push_time = parse_time(data['push_time'])
+        schedule.own_push_time = True
+    return chat_id, schedule.to_dict()
+
+async def import_chats(lines: Iterable[str], batch_size: int = IMPORT_BATCH_SIZE) -> Dict[str, int]:
+    """Загрузить чаты из JSONL пачками по batch_size строк.
+
+    Файл читается потоком, в памяти только текущая пачка. Повтор чата
+    внутри пачки схлопывается (побеждает последняя строка), между пачками -
+    перезаписывает расписание. Неверные строки пропускаются с предупреждением.
+    """
+    result = {'read': 0, 'added': 0, 'duplicates': 0, 'invalid': 0}
+    batch: Dict[int, Optional[dict]] = {}
     
-    # Запускаем планировщик при старте
-    application.run_polling(
-        drop_pending_updates=True,
-        allowed_updates=Update.ALL_TYPES
+    def flush() -> None:
+        result['added'] += bot_data.storage.import_chats(list(batch.items()))
+        batch.clear()
+    
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        result['read'] += 1
+        try:
+            chat_id, schedule = parse_chat_line(line)
+        except (ValueError, KeyError, TypeError) as e:
+            result['invalid'] += 1
+            logger.warning("Строка %d пропущена: %s", number, e)
+            continue
+        if chat_id in batch:
+            result['duplicates'] += 1
+            # Строка без расписания не стирает расписание из предыдущей строки
+            schedule = schedule or batch[chat_id]
+        batch[chat_id] = schedule
+        if len(batch) >= batch_size:
+            flush()
+            # Даём отработать отложенной записи и другим задачам
+            await asyncio.sleep(0)
+    if batch:
+        flush()
+    logger.info(
+        "Импорт: строк %d, новых чатов %d, повторов %d, ошибок %d",
+        result['read'], result['added'], result['duplicates'], result['invalid'],
     )
+    return result
+
+async def run_import(path: str, batch_size: int) -> None:
+    try:
+        if path == '-':
+            await import_chats(sys.stdin, batch_size)
+        else:
+            with open(path, 'r', encoding='utf-8') as f:
+                await import_chats(f, batch_size)
+    finally:
+        # JSON-хранилище дописывается на диск один раз, после всех пачек
+        await bot_data.close()
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бот-напоминалка о пушах")
+    commands = parser.add_subparsers(dest='command')
+    export_parser = commands.add_parser('export', help="выгрузить чаты и расписания в JSONL")
+    export_parser.add_argument('path', nargs='?', default='-', help="файл или - для stdout")
+    import_parser = commands.add_parser(
+        'import', help="загрузить чаты и расписания из JSONL (JSON-хранилище - при остановленном боте)"
+    )
+    import_parser.add_argument('path', nargs='?', default='-', help="файл или - для stdin")
+    import_parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Основная функция запуска бота"""
+    args = parse_args(argv)
+    if args.command == 'export':
+        if args.path == '-':
+            export_chats(sys.stdout)
+        else:
+            with open(args.path, 'w', encoding='utf-8') as f:
+                export_chats(f)
+        bot_data.storage.close()
+        return
+    if args.command == 'import':
+        asyncio.run(run_import(args.path, args.batch_size))
+        return
+    
+    if not TOKEN:
+        raise ValueError("BOT_TOKEN не установлен в переменных окружения")
+    
+    # Создаем приложение
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .post_init(schedule_daily_tasks)
+        .post_shutdown(shutdown)
+        .concurrent_updates(UPDATE_CONCURRENCY)
+        .build()
+    )
+    
+    add_handlers(application)
+    
+    if WORKER_COUNT > 1 and (STORAGE_BACKEND != 'sqlite' or BOT_MODE != 'webhook'):
+        # JSON-файл не делится между процессами, а getUpdates допускает только одного получателя
+        raise ValueError("WORKER_COUNT > 1 требует STORAGE_BACKEND=sqlite и BOT_MODE=webhook")
+    
+    allowed_updates = allowed_update_types(application)
+    logger.info("Режим %s, типы обновлений: %s", BOT_MODE, allowed_updates)
+    
+    # Запускаем планировщик при старте
+    if BOT_MODE == 'webhook':
+        run_webhook(application, allowed_updates)
+    elif BOT_MODE == 'polling':
+        application.run_polling(
+            drop_pending_updates=True,
+            allowed_updates=allowed_updates
+        )
+    else:
+        raise ValueError(f"Неизвестный BOT_MODE: {BOT_MODE}")
 
 if __name__ == "__main__":
     main()
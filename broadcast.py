@@ -0,0 +1,343 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter
+
+from logs import chat_detail
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram Bot API: ~30 сообщений в секунду на бота,
+# 1 сообщение в секунду в личный чат и 20 сообщений в минуту в группу
+GLOBAL_RATE = 25.0
+PRIVATE_CHAT_RATE = 1.0
+GROUP_CHAT_RATE = 20 / 60
+DEFAULT_CONCURRENCY = 20
+MAX_RETRIES = 3
+# Доля оценённой пропускной способности, которую занимает растянутая рассылка
+SPREAD_UTILISATION = 0.5
+LATENCY_SMOOTHING = 0.1
+
+# Классы ошибок отправки
+DEAD = 'dead'            # чат недоступен навсегда
+MIGRATED = 'migrated'    # группа стала супергруппой
+CHAT = 'chat'            # Telegram отклонил сообщение для этого чата
+TRANSIENT = 'transient'  # сбой сети или флуд-контроль: дело не в чате, повторить позже
+ERROR = 'error'          # прочие исключения, скорее всего ошибка в коде
+
+# Ответы BadRequest, после которых писать в чат бессмысленно
+DEAD_CHAT_ERRORS = ('chat not found', 'peer_id_invalid', 'user is deactivated')
+
+FAILURE_BACKOFF_BASE = 60.0
+FAILURE_BACKOFF_MAX = 6 * 3600.0
+MAX_CHAT_FAILURES = 10
+
+SEND_RESULTS = registry.counter(
+    'bot_send_results_total', 'Результаты send_message в рассылках', ['job', 'result']
+)
+SEND_FAILURES = registry.counter(
+    'bot_send_failures_total', 'Неудачные отправки в рассылках по классам ошибок', ['job', 'failure']
+)
+BROADCAST_DURATION = registry.histogram(
+    'bot_broadcast_duration_seconds', 'Длительность рассылки целиком', ['job']
+)
+
+SendFunc = Callable[[int], Awaitable[object]]
+SentCallback = Callable[[int], None]
+FailedCallback = Callable[[int, Exception], None]
+
+
+def chat_slot(chat_id: int) -> float:
+    """Постоянное место чата в окне рассылки, от 0 до 1 (фибоначчиево хеширование id)"""
+    return ((chat_id * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) / 2 ** 64
+
+
+def classify_failure(error: Exception) -> str:
+    """Класс ошибки отправки; на счётчик ошибок чата влияют только DEAD и CHAT"""
+    if isinstance(error, ChatMigrated):
+        return MIGRATED
+    if isinstance(error, Forbidden):
+        # Бота заблокировали, исключили из группы или аккаунт удалён
+        return DEAD
+    if isinstance(error, BadRequest) and any(text in error.message.lower() for text in DEAD_CHAT_ERRORS):
+        return DEAD
+    if isinstance(error, BadRequest):
+        return CHAT
+    # BadRequest - тоже NetworkError, поэтому проверяется выше
+    if isinstance(error, (RetryAfter, NetworkError)):
+        return TRANSIENT
+    return ERROR
+
+
+class ChatHealth:
+    """Счётчики ошибок по вине чата (класс CHAT) с экспоненциальной паузой.
+
+    Чат с ошибками пропускается в рассылках, пока не истечёт пауза;
+    после max_failures ошибок подряд он считается мёртвым.
+    """
+
+    def __init__(
+        self,
+        base_delay: float = FAILURE_BACKOFF_BASE,
+        max_delay: float = FAILURE_BACKOFF_MAX,
+        max_failures: int = MAX_CHAT_FAILURES,
+    ):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_failures = max_failures
+        self.failures: Dict[int, int] = {}
+        self.retry_at: Dict[int, float] = {}
+
+    def record_success(self, chat_id: int) -> None:
+        if chat_id in self.failures:
+            self.forget(chat_id)
+
+    def record_failure(self, chat_id: int) -> int:
+        """Учесть ошибку и вернуть число ошибок подряд"""
+        count = self.failures.get(chat_id, 0) + 1
+        self.failures[chat_id] = count
+        delay = min(self.base_delay * 2 ** (count - 1), self.max_delay)
+        self.retry_at[chat_id] = time.monotonic() + delay
+        return count
+
+    def is_exhausted(self, chat_id: int) -> bool:
+        return self.failures.get(chat_id, 0) >= self.max_failures
+
+    def should_skip(self, chat_id: int) -> bool:
+        """Чат ещё на паузе после недавней ошибки"""
+        retry_at = self.retry_at.get(chat_id)
+        return retry_at is not None and time.monotonic() < retry_at
+
+    def forget(self, chat_id: int) -> None:
+        self.failures.pop(chat_id, None)
+        self.retry_at.pop(chat_id, None)
+
+    def backing_off(self) -> int:
+        """Сколько чатов сейчас на паузе"""
+        now = time.monotonic()
+        return sum(1 for retry_at in self.retry_at.values() if retry_at > now)
+
+
+class TokenBucket:
+    """Ограничитель скорости по алгоритму token bucket"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_idle(self) -> bool:
+        """Корзина полна и не заблокирована - её можно выбросить"""
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+    def pause(self, seconds: float) -> None:
+        """Заблокировать выдачу токенов (ответ RetryAfter от Telegram)"""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    async def acquire(self) -> None:
+        """Дождаться и забрать один токен"""
+        while True:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                await asyncio.sleep(self.blocked_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+@dataclass
+class BroadcastStats:
+    """Итоги одного запуска рассылки"""
+    name: str
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    duration: float = 0.0
+    # Класс ошибки -> число неудачных отправок
+    failures: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def throughput(self) -> float:
+        """Отправлено сообщений в секунду"""
+        return self.sent / self.duration if self.duration > 0 else 0.0
+
+
+class Broadcaster:
+    """Общий движок рассылок с ограничением параллельности и скорости"""
+
+    def __init__(
+        self,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        global_rate: float = GLOBAL_RATE,
+        private_rate: float = PRIVATE_CHAT_RATE,
+        group_rate: float = GROUP_CHAT_RATE,
+        max_retries: int = MAX_RETRIES,
+    ):
+        self.concurrency = concurrency
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.global_rate = global_rate
+        self.global_bucket = TokenBucket(global_rate, capacity=global_rate)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        # Скользящее среднее времени ответа API
+        self.latency: Optional[float] = None
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # Отрицательные id - группы и каналы, у них лимит строже
+            rate = self.group_rate if chat_id < 0 else self.private_rate
+            bucket = self.chat_buckets[chat_id] = TokenBucket(rate)
+        return bucket
+
+    def _prune_buckets(self) -> None:
+        """Убрать корзины чатов, которые уже полностью восстановились"""
+        for chat_id in [c for c, b in self.chat_buckets.items() if b.is_idle()]:
+            del self.chat_buckets[chat_id]
+
+    def _observe_latency(self, seconds: float) -> None:
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += (seconds - self.latency) * LATENCY_SMOOTHING
+
+    def capacity(self) -> float:
+        """Оценка достижимой скорости отправки, сообщений в секунду"""
+        if not self.latency:
+            return self.global_rate
+        return min(self.global_rate, self.concurrency / self.latency)
+
+    def dispatch_span(self, window: float, total: int) -> float:
+        """На сколько секунд растянуть рассылку на total чатов, не дольше window.
+
+        Окно сжимается до времени, за которое рассылка идёт на SPREAD_UTILISATION
+        от оценённой скорости: малые рассылки не ждут зря, а место чата
+        внутри окна меняется плавно вместе с числом получателей.
+        """
+        if window <= 0 or total <= 0:
+            return 0.0
+        return min(window, total / (self.capacity() * SPREAD_UTILISATION))
+
+    async def send(self, chat_id: int, send: SendFunc, stats: Optional[BroadcastStats] = None) -> None:
+        """Отправить одно сообщение с учётом лимитов и RetryAfter.
+
+        Исключения, кроме исчерпанных RetryAfter, пробрасываются вызывающему.
+        """
+        chat_bucket = self._chat_bucket(chat_id)
+        job = stats.name if stats else 'single'
+        attempt = 0
+        while True:
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            sent_at = time.monotonic()
+            try:
+                await send(chat_id)
+                self._observe_latency(time.monotonic() - sent_at)
+                SEND_RESULTS.inc(job=job, result='ok')
+                return
+            except RetryAfter as e:
+                SEND_RESULTS.inc(job=job, result='retry_after')
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = e.retry_after
+                if hasattr(delay, 'total_seconds'):
+                    delay = delay.total_seconds()
+                # 429 означает флуд-контроль на весь бот - тормозим всех
+                self.global_bucket.pause(float(delay))
+                if stats is not None:
+                    stats.retried += 1
+                logger.warning(
+                    "RetryAfter %sс для чата %s, попытка %d", delay, chat_id, attempt,
+                    extra={'chat_id': chat_id, 'retry_after': delay},
+                )
+
+    async def run(
+        self,
+        name: str,
+        chat_ids: Iterable[int],
+        send: SendFunc,
+        on_sent: Optional[SentCallback] = None,
+        on_failed: Optional[FailedCallback] = None,
+        window: float = 0.0,
+        expected: int = 0,
+    ) -> BroadcastStats:
+        """Разослать сообщение по всем чатам.
+
+        chat_ids читается лениво, несколько воркеров разбирают общий итератор.
+        on_sent и on_failed вызываются по результату каждой отправки.
+        С window каждый чат ждёт своего места chat_slot в окне рассылки
+        на expected чатов, поэтому chat_ids должны идти в порядке chat_slot.
+        """
+        stats = BroadcastStats(name=name)
+        chats = iter(chat_ids)
+        started = time.monotonic()
+        span = self.dispatch_span(window, expected)
+        if span:
+            logger.info("Рассылка %s: %d чатов растягивается на %.0fс", name, expected, span)
+
+        async def worker() -> None:
+            for chat_id in chats:
+                stats.total += 1
+                if span:
+                    delay = started + chat_slot(chat_id) * span - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                try:
+                    await self.send(chat_id, send, stats)
+                except Exception as e:
+                    failure = classify_failure(e)
+                    stats.failed += 1
+                    stats.failures[failure] = stats.failures.get(failure, 0) + 1
+                    SEND_RESULTS.inc(job=name, result='forbidden' if isinstance(e, Forbidden) else 'error')
+                    SEND_FAILURES.inc(job=name, failure=failure)
+                    # Итог по ошибкам - в сводке рассылки, по чатам - только подробный лог
+                    if failure == ERROR:
+                        # Непредвиденная ошибка не должна теряться в выборке
+                        logger.error("Ошибка отправки в чат %s: %s", chat_id, e, exc_info=e)
+                    else:
+                        chat_detail(
+                            logger, "Ошибка отправки в чат %s: %s", chat_id, e,
+                            level=logging.WARNING, chat_id=chat_id, broadcast=name, failure=failure,
+                        )
+                    if on_failed:
+                        on_failed(chat_id, e)
+                    continue
+                stats.sent += 1
+                if on_sent:
+                    on_sent(chat_id)
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        stats.duration = time.monotonic() - started
+        BROADCAST_DURATION.observe(stats.duration, job=name)
+        self._prune_buckets()
+        logger.info(
+            "Рассылка %s: отправлено %d/%d, ошибок %d, повторов %d, %.1fс (%.1f сообщ/с)",
+            name, stats.sent, stats.total, stats.failed, stats.retried, stats.duration, stats.throughput,
+            extra={
+                'broadcast': name,
+                'sent': stats.sent,
+                'failed': stats.failed,
+                'retried': stats.retried,
+                'failures': stats.failures,
+                'duration': round(stats.duration, 3),
+            },
+        )
+        return stats
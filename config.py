@@ -1,3 +1,75 @@
 import os
+import datetime
+import json
+from dataclasses import dataclass, field
+from typing import Dict, Tuple
+
+from scheduler import DEFAULT_INTERVAL_DAYS, DEFAULT_PREPARE_TIMES, DEFAULT_PUSH_TIME, parse_time
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
+
+DAYS_OF_WEEK = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+
+@dataclass(frozen=True)
+class CronJob:
+    """Рассылка всем чатам по расписанию cron"""
+    kind: str
+    time: datetime.time
+    day_of_week: str = '*'
+
+
+DEFAULT_JOBS: Dict[str, CronJob] = {
+    'daily_stats_12_00': CronJob('daily_stats', datetime.time(12, 0)),
+    'weekly_push_tue_12_00': CronJob('weekly_push', datetime.time(12, 0), 'tue'),
+}
+
+
+@dataclass(frozen=True)
+class ScheduleConfig:
+    """Определения расписаний: цикл пушей по умолчанию и рассылки по cron"""
+    interval_days: int = DEFAULT_INTERVAL_DAYS
+    prepare_times: Tuple[datetime.time, ...] = DEFAULT_PREPARE_TIMES
+    push_time: datetime.time = DEFAULT_PUSH_TIME
+    jobs: Dict[str, CronJob] = field(default_factory=lambda: dict(DEFAULT_JOBS))
+
+
+def _parse_job(job_id: str, data: dict) -> CronJob:
+    day_of_week = data.get('day_of_week', '*')
+    if day_of_week != '*' and not all(day in DAYS_OF_WEEK for day in day_of_week.split(',')):
+        raise ValueError(f"Задача {job_id}: неверный day_of_week {day_of_week}")
+    return CronJob(kind=data['kind'], time=parse_time(data['time']), day_of_week=day_of_week)
+
+
+def load_schedule_config(path: str, interval_days: int = DEFAULT_INTERVAL_DAYS) -> ScheduleConfig:
+    """Прочитать расписания из JSON-файла; без файла - встроенные значения.
+
+    Формат:
+    {
+        "interval_days": 4,
+        "prepare_times": ["11:00", "19:00", "23:30"],
+        "push_time": "10:00",
+        "jobs": {"daily_stats_12_00": {"kind": "daily_stats", "time": "12:00", "day_of_week": "*"}}
+    }
+    """
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return ScheduleConfig(interval_days=interval_days)
+    try:
+        config = ScheduleConfig(
+            interval_days=int(data.get('interval_days', interval_days)),
+            prepare_times=tuple(
+                sorted(parse_time(t) for t in data['prepare_times'])
+            ) if 'prepare_times' in data else DEFAULT_PREPARE_TIMES,
+            push_time=parse_time(data['push_time']) if 'push_time' in data else DEFAULT_PUSH_TIME,
+            jobs={
+                job_id: _parse_job(job_id, job) for job_id, job in data['jobs'].items()
+            } if 'jobs' in data else dict(DEFAULT_JOBS),
+        )
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Неверный формат {path}: {e}") from e
+    if config.interval_days < 1:
+        raise ValueError(f"interval_days должен быть положительным: {config.interval_days}")
+    return config
@@ -0,0 +1,123 @@
+import asyncio
+import datetime
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from scheduler import ChatSchedule
+
+logger = logging.getLogger(__name__)
+
+DIGEST_WINDOW = 30.0
+KIND_SEPARATOR = '+'
+
+# kind -> список чатов или None, если напоминание идёт всем активным чатам
+Due = Dict[str, Optional[List[int]]]
+# kind -> плановое время события этого типа, попавшего в дайджест
+Sources = Dict[str, datetime.datetime]
+FlushFunc = Callable[[datetime.datetime, Due, Sources], Awaitable[None]]
+
+
+def join_kinds(kinds: Iterable[str]) -> str:
+    return KIND_SEPARATOR.join(kinds)
+
+
+def split_kinds(kind: str) -> List[str]:
+    return kind.split(KIND_SEPARATOR)
+
+
+def event_key(kind: str, fire_at: datetime.datetime) -> str:
+    """Ключ исходного события: тип и плановое время, не зависит от состава дайджеста"""
+    return f"{kind}@{fire_at:%Y-%m-%dT%H:%M}"
+
+
+class DigestBuffer:
+    """Сборщик напоминаний, наступивших почти одновременно.
+
+    Первое напоминание открывает окно на window секунд, всё пришедшее за это
+    время уходит одним вызовом flush. Каждый вызов add ждёт этого flush:
+    пока рассылка не записана в outbox, событие нельзя считать обработанным.
+    """
+
+    def __init__(self, flush: FlushFunc, window: float = DIGEST_WINDOW):
+        self.flush = flush
+        self.window = window
+        self.pending: Optional[Due] = None
+        self.sources: Sources = {}
+        self.opened_at: Optional[datetime.datetime] = None
+        # Результат flush открытого окна: None или исключение, с которым он упал
+        self.flushed: Optional[asyncio.Future] = None
+
+    def _merge(self, kind: str, fire_at: datetime.datetime, chat_ids: Optional[List[int]]) -> None:
+        self.sources.setdefault(kind, fire_at)
+        if kind not in self.pending:
+            self.pending[kind] = None if chat_ids is None else list(chat_ids)
+        elif chat_ids is None or self.pending[kind] is None:
+            self.pending[kind] = None
+        else:
+            self.pending[kind].extend(chat_ids)
+
+    async def add(self, kind: str, fire_at: datetime.datetime, chat_ids: Optional[List[int]]) -> None:
+        """Добавить напоминание kind для chat_ids (None - всем чатам)"""
+        if self.pending is not None:
+            self._merge(kind, fire_at, chat_ids)
+            logger.info("Напоминание %s присоединено к дайджесту %s", kind, self.opened_at)
+            # shield: отмена присоединившегося не должна трогать общий результат
+            error = await asyncio.shield(self.flushed)
+            if error is not None:
+                raise error
+            return
+        self.pending = {}
+        self.sources = {}
+        self.opened_at = fire_at
+        self._merge(kind, fire_at, chat_ids)
+        flushed = self.flushed = asyncio.get_running_loop().create_future()
+        try:
+            try:
+                if self.window > 0:
+                    await asyncio.sleep(self.window)
+            finally:
+                due, self.pending = self.pending, None
+                sources, self.sources = self.sources, {}
+                self.flushed = None
+            await self.flush(fire_at, due, sources)
+        except BaseException as e:
+            flushed.set_result(e)
+            raise
+        flushed.set_result(None)
+
+
+def compose_digest(
+    due: Due,
+    order: Sequence[str],
+    all_schedules: Callable[[], Iterator[ChatSchedule]],
+    lookup: Callable[[int], ChatSchedule],
+) -> Iterator[Tuple[int, str]]:
+    """Разложить дайджест по чатам: (chat_id, склеенные типы напоминаний).
+
+    Типы идут в порядке order, отключённые в чате типы выбрасываются,
+    чат без единого включённого типа пропускается.
+    """
+    kinds = [kind for kind in order if kind in due]
+    to_all = [kind for kind in kinds if due[kind] is None]
+    targeted: Dict[int, set] = {}
+    for kind in kinds:
+        for chat_id in due[kind] or ():
+            targeted.setdefault(chat_id, set()).add(kind)
+
+    def chat_kinds(schedule: ChatSchedule, extra: set) -> str:
+        return join_kinds(
+            kind for kind in kinds
+            if (kind in to_all or kind in extra) and schedule.wants(kind)
+        )
+
+    if to_all:
+        # Напоминание всем: проходим по хранилищу лениво, без списка в памяти
+        for schedule in all_schedules():
+            joined = chat_kinds(schedule, targeted.get(schedule.chat_id, ()))
+            if joined:
+                yield schedule.chat_id, joined
+        return
+    for chat_id, extra in targeted.items():
+        joined = chat_kinds(lookup(chat_id), extra)
+        if joined:
+            yield chat_id, joined
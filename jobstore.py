@@ -0,0 +1,65 @@
+import datetime
+import logging
+import sqlite3
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JobStore:
+    """Время последнего запуска задач по расписанию в SQLite.
+
+    По этим отметкам после рестарта считается, какие запуски были пропущены,
+    пока бот не работал.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job_runs (
+                job_id TEXT PRIMARY KEY,
+                last_run TEXT NOT NULL
+            )
+            """
+        )
+        # Последнее записанное значение: не пишем в базу ту же отметку повторно.
+        # Верно, пока в базу пишет только этот процесс, см. clear_cache
+        self.cache: Dict[str, datetime.datetime] = {}
+
+    def get_last_run(self, job_id: str) -> Optional[datetime.datetime]:
+        if job_id in self.cache:
+            return self.cache[job_id]
+        row = self.conn.execute("SELECT last_run FROM job_runs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        self.cache[job_id] = datetime.datetime.fromisoformat(row[0])
+        return self.cache[job_id]
+
+    def set_last_run(self, job_id: str, when: datetime.datetime) -> None:
+        """Запомнить запуск; отметка только растёт"""
+        last = self.get_last_run(job_id)
+        if last is not None and when <= last:
+            return
+        self.cache[job_id] = when
+        # Отметки пишутся в одном часовом поясе, так что строки сравниваются как время
+        self.conn.execute(
+            "INSERT INTO job_runs (job_id, last_run) VALUES (?, ?) "
+            "ON CONFLICT(job_id) DO UPDATE SET last_run = excluded.last_run "
+            "WHERE excluded.last_run > job_runs.last_run",
+            (job_id, when.isoformat())
+        )
+
+    def clear_cache(self) -> None:
+        """Забыть прочитанные отметки: их мог сдвинуть другой процесс, пока этот не был лидером"""
+        self.cache.clear()
+
+    def forget(self, job_id: str) -> None:
+        self.cache.pop(job_id, None)
+        self.conn.execute("DELETE FROM job_runs WHERE job_id = ?", (job_id,))
+
+    def close(self) -> None:
+        self.conn.close()
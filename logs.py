@@ -0,0 +1,102 @@
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from typing import Optional
+
+LOG_FORMAT_JSON = 'json'
+LOG_FORMAT_TEXT = 'text'
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Доля подробных записей по отдельным чатам, попадающих в лог на уровне INFO
+sample_rate = 0.0
+
+# Поля LogRecord, которые не относятся к переданному через extra
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON; поля из extra попадают в неё как есть"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(
+            (key, value) for key, value in vars(record).items()
+            if key not in _RECORD_FIELDS and not key.startswith('_')
+        )
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """Кладёт запись в очередь, откладывая форматирование до потока записи.
+
+    Здесь только подставляются аргументы сообщения: объекты в args могут
+    измениться, пока запись ждёт в очереди. Трейсбек превращается в текст,
+    потому что сам объект исключения в другой поток не передаём.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(
+    level: str = 'INFO', fmt: str = LOG_FORMAT_JSON, sample: float = 0.0
+) -> logging.handlers.QueueListener:
+    """Направить логи через очередь в отдельный поток, который пишет в stderr.
+
+    Обработчики событий только ставят запись в очередь и не ждут вывода.
+    Возвращает запущенный QueueListener: его нужно остановить при выходе,
+    чтобы дописать оставшиеся записи.
+    """
+    global sample_rate
+    sample_rate = sample
+    if fmt not in (LOG_FORMAT_JSON, LOG_FORMAT_TEXT):
+        raise ValueError(f"Неизвестный формат логов: {fmt}")
+    stream = logging.StreamHandler(sys.stderr)
+    stream.setFormatter(JsonFormatter() if fmt == LOG_FORMAT_JSON else logging.Formatter(TEXT_FORMAT))
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_QueueHandler(log_queue))
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def chat_detail(log: logging.Logger, msg: str, *args, level: int = logging.DEBUG, **extra) -> None:
+    """Подробность по одному чату в массовой рассылке.
+
+    Пишется на уровне DEBUG, а при обычном уровне - только для доли
+    sample_rate записей, с пометкой sampled.
+    """
+    if log.isEnabledFor(logging.DEBUG):
+        log.log(level, msg, *args, extra=extra)
+    elif sample_rate and log.isEnabledFor(logging.INFO) and random.random() < sample_rate:
+        log.log(max(level, logging.INFO), msg, *args, extra=dict(extra, sampled=True))
+
+
+def stop_logging(listener: Optional[logging.handlers.QueueListener]) -> None:
+    """Дописать очередь и остановить поток записи логов"""
+    if listener is not None:
+        listener.stop()
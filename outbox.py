@@ -0,0 +1,256 @@
+import datetime
+import logging
+import sqlite3
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from broadcast import chat_slot
+from digest import join_kinds, split_kinds
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+SENT = 'sent'
+FAILED = 'failed'
+EXPIRED = 'expired'
+SKIPPED = 'skipped'
+
+OUTBOX_PAGE_SIZE = 1000
+ENQUEUE_BATCH_SIZE = 5000
+
+
+class Outbox:
+    """Журнал исходящих рассылок в SQLite.
+
+    Каждая рассылка раскладывается на строки с ключом (job, run_date, chat_id),
+    статус доставки пишется по каждой строке. После рестарта недоставленные
+    строки дорассылаются, а повторная постановка той же рассылки ничего не дублирует.
+
+    Дайджест склеивает несколько исходных событий, и состав склейки зависит от
+    того, что попало в окно. Поэтому каждое событие (тип и плановое время)
+    отдельно закрепляется за чатом в outbox_events: событие, уже поставленное
+    в очередь под любым именем рассылки, второй раз в строку не попадёт.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                run_date TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                slot REAL NOT NULL DEFAULT 0,
+                UNIQUE (job, run_date, chat_id)
+            );
+            CREATE TABLE IF NOT EXISTS outbox_events (
+                event TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                run_date TEXT NOT NULL,
+                PRIMARY KEY (event, chat_id)
+            );
+            CREATE TABLE IF NOT EXISTS outbox_jobs (
+                job TEXT NOT NULL,
+                run_date TEXT NOT NULL,
+                ready INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (job, run_date)
+            );
+            """
+        )
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(outbox)")}
+        if 'slot' not in columns:
+            self.conn.execute("ALTER TABLE outbox ADD COLUMN slot REAL NOT NULL DEFAULT 0")
+        self.conn.executescript(
+            """
+            DROP INDEX IF EXISTS outbox_status;
+            CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, job, run_date, slot, id);
+            """
+        )
+
+    @staticmethod
+    def _now() -> str:
+        return datetime.datetime.now().isoformat()
+
+    def enqueue(self, kind: str, job: str, run_date: datetime.date, chat_ids: Iterable[int]) -> int:
+        """Поставить рассылку одного типа в очередь, вернуть число новых строк"""
+        return self.enqueue_rows(job, run_date, ((chat_id, kind) for chat_id in chat_ids))
+
+    def _claim(self, chat_id: int, kind: str, events: Dict[str, str], day: str) -> str:
+        # Оставить в склейке только типы, чьи события ещё не стоят в очереди у этого чата
+        claimed = []
+        for single in split_kinds(kind):
+            event = events.get(single)
+            if event is None or self.conn.execute(
+                "INSERT OR IGNORE INTO outbox_events (event, chat_id, run_date) VALUES (?, ?, ?)",
+                (event, chat_id, day)
+            ).rowcount:
+                claimed.append(single)
+        return join_kinds(claimed)
+
+    def enqueue_rows(
+        self,
+        job: str,
+        run_date: datetime.date,
+        rows: Iterable[Tuple[int, str]],
+        events: Optional[Dict[str, str]] = None,
+    ) -> int:
+        """Поставить в очередь строки (chat_id, kind): у каждого чата свой состав сообщения.
+
+        events - ключ исходного события для каждого типа; типы, чьё событие
+        уже поставлено чату в очередь, выбрасываются из строки.
+        """
+        now = self._now()
+        day = run_date.isoformat()
+        inserted = 0
+        batch: List[Tuple[int, str]] = []
+        # Пока строки пишутся пачками, рассылка не видна другим процессам в pending_jobs
+        self.conn.execute(
+            "INSERT INTO outbox_jobs (job, run_date, ready) VALUES (?, ?, 0) "
+            "ON CONFLICT(job, run_date) DO UPDATE SET ready = 0",
+            (job, day)
+        )
+
+        def flush() -> int:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                before = self.conn.total_changes
+                values = []
+                for chat_id, kind in batch:
+                    if events:
+                        kind = self._claim(chat_id, kind, events, day)
+                        if not kind:
+                            continue
+                    values.append((job, kind, day, chat_id, chat_slot(chat_id), now, now))
+                claims = self.conn.total_changes - before
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO outbox (job, kind, run_date, chat_id, slot, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    values
+                )
+                return self.conn.total_changes - before - claims
+
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= ENQUEUE_BATCH_SIZE:
+                inserted += flush()
+                batch = []
+        if batch:
+            inserted += flush()
+        self.conn.execute("UPDATE outbox_jobs SET ready = 1 WHERE job = ? AND run_date = ?", (job, day))
+        logger.info("Рассылка %s за %s: в очередь добавлено %d строк", job, day, inserted)
+        return inserted
+
+    def pending_jobs(self, ready_only: bool = True) -> List[Tuple[str, datetime.date]]:
+        """Рассылки, в которых остались недоставленные строки: (job, run_date).
+
+        С ready_only пропускаются рассылки, которые ещё ставятся в очередь:
+        по неполному набору строк другой процесс решил бы, что всё разослано.
+        Строки без отметки (из старых версий) считаются готовыми.
+        """
+        rows = self.conn.execute(
+            "SELECT DISTINCT o.job, o.run_date FROM outbox o "
+            "LEFT JOIN outbox_jobs j ON j.job = o.job AND j.run_date = o.run_date "
+            "WHERE o.status = ? AND (? = 0 OR j.ready IS NULL OR j.ready = 1) "
+            "ORDER BY o.run_date, o.job",
+            (PENDING, int(ready_only))
+        ).fetchall()
+        return [(job, datetime.date.fromisoformat(day)) for job, day in rows]
+
+    def iter_pending(self, job: str, run_date: datetime.date) -> Iterator[Tuple[int, str]]:
+        """Лениво перебрать (chat_id, kind) строк, которые ещё не доставлены, в порядке слотов"""
+        day = run_date.isoformat()
+        last = (-1.0, 0)
+        while True:
+            rows = self.conn.execute(
+                "SELECT slot, id, chat_id, kind FROM outbox "
+                "WHERE status = ? AND job = ? AND run_date = ? AND (slot, id) > (?, ?) "
+                "ORDER BY slot, id LIMIT ?",
+                (PENDING, job, day, *last, OUTBOX_PAGE_SIZE)
+            ).fetchall()
+            if not rows:
+                return
+            for _, _, chat_id, kind in rows:
+                yield chat_id, kind
+            last = rows[-1][:2]
+
+    def count_pending(self, job: str, run_date: datetime.date) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM outbox WHERE status = ? AND job = ? AND run_date = ?",
+            (PENDING, job, run_date.isoformat())
+        ).fetchone()[0]
+
+    def pending_kinds(self, job: str, run_date: datetime.date) -> Set[str]:
+        """Типы напоминаний, которые ещё ждут доставки в рассылке"""
+        rows = self.conn.execute(
+            "SELECT DISTINCT kind FROM outbox WHERE status = ? AND job = ? AND run_date = ?",
+            (PENDING, job, run_date.isoformat())
+        ).fetchall()
+        return {kind for (kind,) in rows}
+
+    def mark_sent(self, job: str, run_date: datetime.date, chat_id: int) -> None:
+        self.conn.execute(
+            "UPDATE outbox SET status = ?, attempts = attempts + 1, updated_at = ? "
+            "WHERE job = ? AND run_date = ? AND chat_id = ?",
+            (SENT, self._now(), job, run_date.isoformat(), chat_id)
+        )
+
+    def mark_failed(self, job: str, run_date: datetime.date, chat_id: int, error: str) -> None:
+        self.conn.execute(
+            "UPDATE outbox SET status = ?, attempts = attempts + 1, last_error = ?, updated_at = ? "
+            "WHERE job = ? AND run_date = ? AND chat_id = ?",
+            (FAILED, error[:500], self._now(), job, run_date.isoformat(), chat_id)
+        )
+
+    def mark_retry(self, job: str, run_date: datetime.date, chat_id: int, error: str) -> None:
+        """Оставить строку недоставленной после временного сбоя, учтя попытку"""
+        self.conn.execute(
+            "UPDATE outbox SET attempts = attempts + 1, last_error = ?, updated_at = ? "
+            "WHERE job = ? AND run_date = ? AND chat_id = ?",
+            (error[:500], self._now(), job, run_date.isoformat(), chat_id)
+        )
+
+    def mark_skipped(self, job: str, run_date: datetime.date, chat_id: int, reason: str) -> None:
+        """Не отправлять строку: чат выключен или на паузе после ошибок"""
+        self.conn.execute(
+            "UPDATE outbox SET status = ?, last_error = ?, updated_at = ? "
+            "WHERE job = ? AND run_date = ? AND chat_id = ?",
+            (SKIPPED, reason, self._now(), job, run_date.isoformat(), chat_id)
+        )
+
+    def expire(self, before: datetime.date) -> int:
+        """Не дорассылать устаревшие напоминания"""
+        cursor = self.conn.execute(
+            "UPDATE outbox SET status = ?, updated_at = ? WHERE status = ? AND run_date < ?",
+            (EXPIRED, self._now(), PENDING, before.isoformat())
+        )
+        return cursor.rowcount
+
+    def purge(self, before: datetime.date) -> int:
+        """Удалить завершённые строки старше before"""
+        cursor = self.conn.execute(
+            "DELETE FROM outbox WHERE status != ? AND run_date < ?",
+            (PENDING, before.isoformat())
+        )
+        self.conn.execute("DELETE FROM outbox_events WHERE run_date < ?", (before.isoformat(),))
+        self.conn.execute("DELETE FROM outbox_jobs WHERE run_date < ?", (before.isoformat(),))
+        return cursor.rowcount
+
+    def pending_count(self) -> int:
+        """Глубина очереди: сколько строк ждут доставки"""
+        return self.conn.execute("SELECT COUNT(*) FROM outbox WHERE status = ?", (PENDING,)).fetchone()[0]
+
+    def counts(self) -> Dict[str, int]:
+        """Число строк по статусам"""
+        return dict(self.conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+
+    def close(self) -> None:
+        self.conn.close()
@@ -0,0 +1,93 @@
+import logging
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from telegram import Message
+from telegram.ext.filters import MessageFilter
+
+from storage import Storage
+
+logger = logging.getLogger(__name__)
+
+DATE_PROMPT_TTL = 600.0
+
+PromptKey = Tuple[int, int]
+
+
+class PendingPrompts:
+    """Пары (чат, пользователь), от которых бот ждёт ввода даты.
+
+    Состояние живёт в памяти для быстрой проверки и дублируется в хранилище,
+    чтобы пережить рестарт; запрос без ответа дольше ttl секунд забывается.
+    С shared хранилище общее для нескольких процессов: запрос мог задать
+    другой процесс, поэтому при промахе в памяти проверяется хранилище.
+    """
+
+    def __init__(self, storage: Storage, ttl: float = DATE_PROMPT_TTL, shared: bool = False):
+        self.storage = storage
+        self.ttl = ttl
+        self.shared = shared
+        self.expires: Dict[PromptKey, float] = {}
+
+    def load(self) -> None:
+        """Перечитать ожидания из хранилища, просроченные удалить"""
+        now = time.time()
+        expires = {}
+        for chat_id, user_id, expires_at in self.storage.iter_prompts():
+            if expires_at > now:
+                expires[(chat_id, user_id)] = expires_at
+            else:
+                self.storage.clear_prompt(chat_id, user_id)
+        self.expires = expires
+
+    def _sweep(self, now: float) -> None:
+        for chat_id, user_id in [key for key, expires_at in self.expires.items() if expires_at <= now]:
+            del self.expires[(chat_id, user_id)]
+            self.storage.clear_prompt(chat_id, user_id)
+            logger.info("Истекло ожидание даты в чате %s от %s", chat_id, user_id)
+
+    def add(self, chat_id: int, user_id: int) -> None:
+        now = time.time()
+        self._sweep(now)
+        self.expires[(chat_id, user_id)] = now + self.ttl
+        self.storage.set_prompt(chat_id, user_id, now + self.ttl)
+
+    def discard(self, chat_id: int, user_id: int) -> None:
+        if self.expires.pop((chat_id, user_id), None) is not None or self.shared:
+            self.storage.clear_prompt(chat_id, user_id)
+
+    def _lookup(self, chat_id: int, user_id: int) -> Optional[float]:
+        expires_at = self.expires.get((chat_id, user_id))
+        if expires_at is None and self.shared:
+            expires_at = self.storage.get_prompt(chat_id, user_id)
+            if expires_at is not None:
+                self.expires[(chat_id, user_id)] = expires_at
+        return expires_at
+
+    def is_waiting(self, chat_id: int, user_id: int) -> bool:
+        expires_at = self._lookup(chat_id, user_id)
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            self.discard(chat_id, user_id)
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self.expires)
+
+
+class AwaitingDate(MessageFilter):
+    """Пропускает только сообщения от тех, у кого бот запросил дату.
+
+    Остальной текст в группах отсекается до запуска обработчика.
+    """
+
+    def __init__(self, prompts: Callable[[], PendingPrompts]):
+        super().__init__(name='AwaitingDate')
+        self.prompts = prompts
+
+    def filter(self, message: Message) -> bool:
+        if message.from_user is None:
+            return False
+        return self.prompts().is_waiting(message.chat.id, message.from_user.id)
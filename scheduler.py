@@ -0,0 +1,449 @@
+import asyncio
+import datetime
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL_DAYS = 4
+DEFAULT_PREPARE_TIMES: Tuple[datetime.time, ...] = (
+    datetime.time(11, 0), datetime.time(19, 0), datetime.time(23, 30)
+)
+DEFAULT_PUSH_TIME = datetime.time(10, 0)
+MISFIRE_GRACE_SECONDS = 300
+LOAD_BATCH_SIZE = 1000
+
+# Что делать с событиями, пропущенными дольше misfire_grace (бот был выключен)
+CATCH_UP_COALESCE = 'coalesce'  # у чата срабатывает только последнее пропущенное
+CATCH_UP_RUN_ONCE = 'run_once'  # каждое пропущенное срабатывает один раз
+CATCH_UP_SKIP = 'skip'          # пропущенное выбрасывается
+CATCH_UP_POLICIES = (CATCH_UP_COALESCE, CATCH_UP_RUN_ONCE, CATCH_UP_SKIP)
+
+PREPARE = 'prepare'
+PUSH_DAY = 'push_day'
+
+DueHandler = Callable[[str, datetime.datetime, List[int]], Awaitable[None]]
+ProgressCallback = Callable[[datetime.datetime], None]
+Clock = Callable[[], datetime.datetime]
+
+
+def parse_time(value: str) -> datetime.time:
+    """Разобрать время в формате ЧЧ:ММ"""
+    return datetime.datetime.strptime(value, '%H:%M').time()
+
+
+def combine(day: datetime.date, time: datetime.time, tz: Optional[datetime.tzinfo]) -> datetime.datetime:
+    """Собрать datetime в поясе tz (pytz требует localize вместо tzinfo=)"""
+    naive = datetime.datetime.combine(day, time)
+    if tz is None:
+        return naive
+    if hasattr(tz, 'localize'):
+        return tz.localize(naive)
+    return naive.replace(tzinfo=tz)
+
+
+def first_cycle_on_or_after(start_date: datetime.date, interval: int, day: datetime.date) -> datetime.date:
+    """Первая дата цикла start_date + k * interval, не раньше day"""
+    if start_date >= day:
+        return start_date
+    cycles = -(-(day - start_date).days // interval)
+    return start_date + datetime.timedelta(days=cycles * interval)
+
+
+def first_cycle_after(start_date: datetime.date, interval: int, day: datetime.date) -> datetime.date:
+    """Первая дата цикла строго после day"""
+    return first_cycle_on_or_after(start_date, interval, day + datetime.timedelta(days=1))
+
+
+@dataclass
+class ChatSchedule:
+    """Расписание пушей одного чата"""
+    chat_id: int
+    start_date: datetime.date
+    interval_days: int = DEFAULT_INTERVAL_DAYS
+    prepare_times: Tuple[datetime.time, ...] = DEFAULT_PREPARE_TIMES
+    push_time: datetime.time = DEFAULT_PUSH_TIME
+    # Типы напоминаний, от которых чат отписался
+    muted: Tuple[str, ...] = ()
+    # Чат задал своё время напоминаний или интервал; без этого действуют значения из конфига
+    own_prepare_times: bool = False
+    own_push_time: bool = False
+    own_interval_days: bool = False
+
+    def to_dict(self) -> dict:
+        # Интервал и время напоминаний храним, только если чат задал свои
+        data = {'start_date': self.start_date.strftime('%Y-%m-%d')}
+        if self.own_interval_days:
+            data['interval_days'] = self.interval_days
+        if self.own_prepare_times:
+            data['prepare_times'] = [t.strftime('%H:%M') for t in self.prepare_times]
+        if self.own_push_time:
+            data['push_time'] = self.push_time.strftime('%H:%M')
+        if self.muted:
+            data['muted'] = list(self.muted)
+        return data
+
+    @classmethod
+    def from_dict(
+        cls,
+        chat_id: int,
+        data: dict,
+        prepare_times: Tuple[datetime.time, ...] = DEFAULT_PREPARE_TIMES,
+        push_time: datetime.time = DEFAULT_PUSH_TIME,
+        interval_days: int = DEFAULT_INTERVAL_DAYS,
+    ) -> 'ChatSchedule':
+        """Интервал и время напоминаний из data, если они сохранены, иначе переданные по умолчанию"""
+        return cls(
+            chat_id=chat_id,
+            start_date=datetime.datetime.strptime(data['start_date'], '%Y-%m-%d').date(),
+            interval_days=int(data.get('interval_days', interval_days)),
+            prepare_times=tuple(
+                parse_time(t) for t in data['prepare_times']
+            ) if 'prepare_times' in data else prepare_times,
+            push_time=parse_time(data['push_time']) if 'push_time' in data else push_time,
+            muted=tuple(data.get('muted', ())),
+            own_prepare_times='prepare_times' in data,
+            own_push_time='push_time' in data,
+            own_interval_days='interval_days' in data,
+        )
+
+    def apply_defaults(
+        self, prepare_times: Tuple[datetime.time, ...], push_time: datetime.time, interval_days: int
+    ) -> bool:
+        """Подставить значения из конфига туда, где у чата нет своих; True, если что-то изменилось"""
+        before = (self.prepare_times, self.push_time, self.interval_days)
+        if not self.own_prepare_times:
+            self.prepare_times = prepare_times
+        if not self.own_push_time:
+            self.push_time = push_time
+        if not self.own_interval_days:
+            self.interval_days = interval_days
+        return (self.prepare_times, self.push_time, self.interval_days) != before
+
+    def wants(self, kind: str) -> bool:
+        """Чат не отписан от напоминаний этого типа"""
+        return kind not in self.muted
+
+    def toggle_muted(self, kind: str) -> None:
+        if kind in self.muted:
+            self.muted = tuple(k for k in self.muted if k != kind)
+        else:
+            self.muted = self.muted + (kind,)
+
+    def push_dates(self, start: datetime.date, days: int) -> List[datetime.date]:
+        """Даты пушей в окне [start, start + days)"""
+        first = first_cycle_on_or_after(self.start_date, self.interval_days, start)
+        offset = (first - start).days
+        return [start + datetime.timedelta(days=d) for d in range(offset, days, self.interval_days)]
+
+    def next_push_date(self, now: datetime.datetime) -> datetime.date:
+        """Дата ближайшего пуша, напоминание о котором ещё не отправлено"""
+        push_date = first_cycle_on_or_after(self.start_date, self.interval_days, now.date())
+        if combine(push_date, self.push_time, now.tzinfo) <= now:
+            push_date += datetime.timedelta(days=self.interval_days)
+        return push_date
+
+    def next_event(self, after: datetime.datetime) -> Tuple[datetime.datetime, str]:
+        """Ближайшее событие расписания строго после after"""
+        push_date = self.next_push_date(after)
+        tz = after.tzinfo
+        event = (combine(push_date, self.push_time, tz), PUSH_DAY)
+        prepare_date = push_date - datetime.timedelta(days=1)
+        for prepare_time in self.prepare_times:
+            fire_at = combine(prepare_date, prepare_time, tz)
+            if after < fire_at < event[0]:
+                event = (fire_at, PREPARE)
+        return event
+
+
+@dataclass
+class PushCalendar:
+    """Сколько пушей и напоминаний приходится на каждый день окна"""
+    start: datetime.date
+    push_counts: List[int]
+    prepare_counts: List[int]
+    sends: List[int]
+
+    @property
+    def days(self) -> int:
+        return len(self.sends)
+
+    def dates(self) -> List[datetime.date]:
+        return [self.start + datetime.timedelta(days=d) for d in range(self.days)]
+
+    def busiest(self, count: int = 5) -> List[Tuple[datetime.date, int]]:
+        """Дни с наибольшим числом отправок"""
+        return sorted(zip(self.dates(), self.sends), key=lambda item: -item[1])[:count]
+
+
+def _cycle_groups(
+    schedules: Iterable[ChatSchedule], start: datetime.date, horizon: int
+) -> Dict[Tuple[int, int], List[ChatSchedule]]:
+    # Чаты с одинаковым интервалом и первой датой в окне дают один и тот же ряд дат,
+    # поэтому один проход раскладывает их по группам, а ряды считаются на группу
+    groups: Dict[Tuple[int, int], List[ChatSchedule]] = {}
+    for schedule in schedules:
+        first = first_cycle_on_or_after(schedule.start_date, schedule.interval_days, start)
+        offset = (first - start).days
+        if offset < horizon:
+            groups.setdefault((schedule.interval_days, offset), []).append(schedule)
+    return groups
+
+
+def project_calendar(schedules: Iterable[ChatSchedule], start: datetime.date, days: int) -> PushCalendar:
+    """Нагрузка по дням для множества чатов без цикла по дням на каждый чат"""
+    push_counts = [0] * days
+    prepare_counts = [0] * days
+    sends = [0] * days
+    # Пуш на следующий день после окна даёт напоминания в его последний день
+    horizon = days + 1
+    for (interval, offset), group in _cycle_groups(schedules, start, horizon).items():
+        count = len(group)
+        prepare_sends = sum(len(schedule.prepare_times) for schedule in group)
+        for day in range(offset, horizon, interval):
+            if day < days:
+                push_counts[day] += count
+                sends[day] += count
+            if day >= 1:
+                prepare_counts[day - 1] += count
+                sends[day - 1] += prepare_sends
+    return PushCalendar(start, push_counts, prepare_counts, sends)
+
+
+def project_push_dates(
+    schedules: Iterable[ChatSchedule], start: datetime.date, days: int
+) -> Dict[int, List[datetime.date]]:
+    """Даты пушей каждого чата в окне; чаты одной группы делят один список"""
+    result: Dict[int, List[datetime.date]] = {}
+    for (interval, offset), group in _cycle_groups(schedules, start, days).items():
+        dates = [start + datetime.timedelta(days=d) for d in range(offset, days, interval)]
+        for schedule in group:
+            result[schedule.chat_id] = dates
+    return result
+
+
+@dataclass(order=True)
+class _Entry:
+    fire_at: datetime.datetime
+    seq: int
+    chat_id: int = field(compare=False)
+    kind: str = field(compare=False)
+    version: int = field(compare=False)
+
+
+class DueScheduler:
+    """Планировщик на куче: по одной записи на чат, просыпается только к ближайшему событию.
+
+    Устаревшие записи не удаляются из кучи, а пропускаются по номеру версии.
+    Внутри куча хранит наивное местное время: localize из pytz дорог на каждое событие.
+
+    on_progress получает отметку, до которой все события уже отданы обработчику
+    и обработаны; загрузка с since=отметка после рестарта догоняет пропущенное
+    по политике catch_up.
+    """
+
+    def __init__(
+        self,
+        handler: DueHandler,
+        tz: datetime.tzinfo,
+        misfire_grace: float = MISFIRE_GRACE_SECONDS,
+        clock: Optional[Clock] = None,
+        catch_up: str = CATCH_UP_COALESCE,
+        on_progress: Optional[ProgressCallback] = None,
+    ):
+        if catch_up not in CATCH_UP_POLICIES:
+            raise ValueError(f"Неизвестная политика догоняющего запуска: {catch_up}")
+        self.handler = handler
+        self.tz = tz
+        self.clock = clock
+        self.catch_up = catch_up
+        self.on_progress = on_progress
+        self.misfire_grace = datetime.timedelta(seconds=misfire_grace)
+        self.schedules: Dict[int, ChatSchedule] = {}
+        self.versions: Dict[int, int] = {}
+        self.heap: List[_Entry] = []
+        self.seq = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.running: Dict[asyncio.Task, datetime.datetime] = {}
+        self.dispatched_until: Optional[datetime.datetime] = None
+
+    def now(self) -> datetime.datetime:
+        if self.clock:
+            return self.clock()
+        return datetime.datetime.now(self.tz)
+
+    def _local(self, moment: datetime.datetime) -> datetime.datetime:
+        """Наивное местное время для сравнения с записями кучи"""
+        if moment.tzinfo is None:
+            return moment
+        return moment.astimezone(self.tz).replace(tzinfo=None)
+
+    def _aware(self, moment: datetime.datetime) -> datetime.datetime:
+        return combine(moment.date(), moment.time(), self.tz)
+
+    def _push(self, schedule: ChatSchedule, after: datetime.datetime) -> _Entry:
+        fire_at, kind = schedule.next_event(after)
+        version = self.versions.get(schedule.chat_id, 0)
+        return _Entry(fire_at, next(self.seq), schedule.chat_id, kind, version)
+
+    def _load_after(self, since: Optional[datetime.datetime]) -> datetime.datetime:
+        # Пропущенные в пределах misfire_grace события ещё успеют сработать
+        grace_start = self._local(self.now()) - self.misfire_grace
+        if since is None:
+            return grace_start
+        since = self._local(since)
+        return max(since, grace_start) if self.catch_up == CATCH_UP_SKIP else since
+
+    def _add_loaded(self, schedule: ChatSchedule, after: datetime.datetime) -> None:
+        # Расписание, обновлённое во время загрузки, новее прочитанного из хранилища
+        if schedule.chat_id in self.schedules:
+            return
+        self.schedules[schedule.chat_id] = schedule
+        self.heap.append(self._push(schedule, after))
+
+    def load(self, schedules: Iterable[ChatSchedule], since: Optional[datetime.datetime] = None) -> None:
+        """Заполнить кучу расписаниями всех чатов; since - отметка прошлого запуска"""
+        after = self._load_after(since)
+        for schedule in schedules:
+            self._add_loaded(schedule, after)
+        heapq.heapify(self.heap)
+        self.wakeup.set()
+        logger.info("Расписания загружены: %d чатов", len(self.schedules))
+
+    async def load_async(
+        self, schedules: Iterable[ChatSchedule], since: Optional[datetime.datetime] = None
+    ) -> None:
+        """Загрузить расписания пачками, отдавая управление event loop между ними"""
+        after = self._load_after(since)
+        started = datetime.datetime.now()
+        for count, schedule in enumerate(schedules, 1):
+            self._add_loaded(schedule, after)
+            if count % LOAD_BATCH_SIZE == 0:
+                await asyncio.sleep(0)
+        heapq.heapify(self.heap)
+        self.wakeup.set()
+        seconds = (datetime.datetime.now() - started).total_seconds()
+        logger.info("Расписания загружены в фоне: %d чатов за %.2fс", len(self.schedules), seconds)
+
+    def update(self, schedule: ChatSchedule) -> None:
+        """Добавить или заменить расписание одного чата"""
+        chat_id = schedule.chat_id
+        self.schedules[chat_id] = schedule
+        self.versions[chat_id] = self.versions.get(chat_id, 0) + 1
+        heapq.heappush(self.heap, self._push(schedule, self._local(self.now())))
+        self.wakeup.set()
+
+    def remove(self, chat_id: int) -> None:
+        """Убрать чат из расписания"""
+        if self.schedules.pop(chat_id, None) is not None:
+            self.versions[chat_id] = self.versions.get(chat_id, 0) + 1
+
+    def retime(
+        self, prepare_times: Tuple[datetime.time, ...], push_time: datetime.time, interval_days: int
+    ) -> int:
+        """Применить новые значения конфига без остановки планировщика.
+
+        Меняются только чаты без своих настроек, у остальных события остаются прежними.
+        Возвращает число перепланированных чатов.
+        """
+        after = self._local(self.now())
+        heap: List[_Entry] = []
+        changed = 0
+        for chat_id, schedule in self.schedules.items():
+            if schedule.apply_defaults(prepare_times, push_time, interval_days):
+                self.versions[chat_id] = self.versions.get(chat_id, 0) + 1
+                changed += 1
+            heap.append(self._push(schedule, after))
+        heapq.heapify(heap)
+        # Новая куча подменяет старую целиком, промежутка без событий нет
+        self.heap = heap
+        self.wakeup.set()
+        logger.info("Расписание по конфигу обновлено для %d чатов из %d", changed, len(self.schedules))
+        return changed
+
+    def _peek(self) -> Optional[_Entry]:
+        """Ближайшая актуальная запись, устаревшие выбрасываются по пути"""
+        while self.heap:
+            entry = self.heap[0]
+            if entry.version == self.versions.get(entry.chat_id, 0) and entry.chat_id in self.schedules:
+                return entry
+            heapq.heappop(self.heap)
+        return None
+
+    def next_fire_time(self) -> Optional[datetime.datetime]:
+        """Время ближайшего актуального события"""
+        entry = self._peek()
+        return self._aware(entry.fire_at) if entry else None
+
+    def pop_due(self, now: datetime.datetime) -> Dict[Tuple[str, datetime.datetime], List[int]]:
+        """Извлечь наступившие события, сгруппированные по типу и плановому времени"""
+        local_due: Dict[Tuple[str, datetime.datetime], List[int]] = {}
+        now = self._local(now)
+        while (entry := self._peek()) is not None and entry.fire_at <= now:
+            heapq.heappop(self.heap)
+            schedule = self.schedules[entry.chat_id]
+            following = self._push(schedule, entry.fire_at)
+            if self._should_fire(entry, following, now):
+                local_due.setdefault((entry.kind, entry.fire_at), []).append(entry.chat_id)
+            else:
+                logger.warning("Пропущено событие %s чата %s (%s)", entry.kind, entry.chat_id, entry.fire_at)
+            heapq.heappush(self.heap, following)
+        self.dispatched_until = now
+        return {(kind, self._aware(fire_at)): chat_ids for (kind, fire_at), chat_ids in local_due.items()}
+
+    def _should_fire(self, entry: _Entry, following: _Entry, now: datetime.datetime) -> bool:
+        if now - entry.fire_at <= self.misfire_grace or self.catch_up == CATCH_UP_RUN_ONCE:
+            return True
+        if self.catch_up == CATCH_UP_COALESCE:
+            # Из подряд пропущенных событий чата срабатывает только последнее
+            return following.fire_at > now
+        return False
+
+    def watermark(self) -> Optional[datetime.datetime]:
+        """Момент, до которого все события обработаны (без учёта ещё работающих)"""
+        if self.running:
+            # Событие, которое ещё рассылается, после рестарта должно сработать снова
+            return self._aware(min(self.running.values()) - datetime.timedelta(microseconds=1))
+        if self.dispatched_until is None:
+            return None
+        return self._aware(self.dispatched_until)
+
+    def _report_progress(self) -> None:
+        if self.on_progress and (mark := self.watermark()) is not None:
+            self.on_progress(mark)
+
+    def _finished(self, task: asyncio.Task) -> None:
+        self.running.pop(task, None)
+        self._report_progress()
+
+    async def _run(self) -> None:
+        while True:
+            self.wakeup.clear()
+            fire_at = self.next_fire_time()
+            timeout = None
+            if fire_at is not None:
+                timeout = max((fire_at - self.now()).total_seconds(), 0)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+                continue
+            except asyncio.TimeoutError:
+                pass
+            for (kind, fire_at), chat_ids in self.pop_due(self.now()).items():
+                # Рассылка идёт отдельной задачей, чтобы не задерживать следующие события
+                task = asyncio.create_task(self.handler(kind, fire_at, chat_ids))
+                self.running[task] = self._local(fire_at)
+                task.add_done_callback(self._finished)
+            self._report_progress()
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
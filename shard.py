@@ -0,0 +1,84 @@
+import bisect
+import hashlib
+import logging
+import sqlite3
+import time
+from typing import List, Sequence
+
+logger = logging.getLogger(__name__)
+
+RING_REPLICAS = 64
+LEASE_TTL = 10.0
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """Кольцо консистентного хеширования чатов по воркерам.
+
+    При смене числа воркеров меняют владельца только чаты соседних участков кольца.
+    """
+
+    def __init__(self, workers: Sequence[int], replicas: int = RING_REPLICAS):
+        points = sorted((_hash(f"{worker}:{i}"), worker) for worker in workers for i in range(replicas))
+        self.keys: List[int] = [key for key, _ in points]
+        self.workers: List[int] = [worker for _, worker in points]
+
+    def owner(self, chat_id: int) -> int:
+        index = bisect.bisect(self.keys, _hash(str(chat_id))) % len(self.keys)
+        return self.workers[index]
+
+
+class LeaderLease:
+    """Аренда лидерства в общем SQLite-файле.
+
+    Лидер продлевает аренду раньше, чем истекает ttl; если он завис или упал,
+    через ttl секунд аренду забирает другой процесс.
+    """
+
+    def __init__(self, path: str, name: str, holder: str, ttl: float = LEASE_TTL):
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self.conn = sqlite3.connect(path, isolation_level=None, timeout=ttl / 2)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+
+    def acquire(self) -> bool:
+        """Взять или продлить аренду; False, если она у другого процесса"""
+        now = time.time()
+        try:
+            with self.conn:
+                self.conn.execute("BEGIN IMMEDIATE")
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO leases (name, holder, expires_at) VALUES (?, ?, ?)",
+                    (self.name, self.holder, now + self.ttl)
+                )
+                cursor = self.conn.execute(
+                    "UPDATE leases SET holder = ?, expires_at = ? "
+                    "WHERE name = ? AND (holder = ? OR expires_at < ?)",
+                    (self.holder, now + self.ttl, self.name, self.holder, now)
+                )
+                return cursor.rowcount > 0
+        except sqlite3.OperationalError as e:
+            # База занята дольше таймаута - считаем, что аренда не продлена
+            logger.error("Не удалось обновить аренду %s: %s", self.name, e)
+            return False
+
+    def release(self) -> None:
+        self.conn.execute(
+            "DELETE FROM leases WHERE name = ? AND holder = ?", (self.name, self.holder)
+        )
+
+    def close(self) -> None:
+        self.conn.close()
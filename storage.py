@@ -0,0 +1,599 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+CHAT_PAGE_SIZE = 1000
+WRITE_BEHIND_DELAY = 0.5
+
+
+def write_json_atomic(path: str, data: dict) -> None:
+    """Записать JSON во временный файл и атомарно подменить им целевой"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Storage(ABC):
+    """Базовый интерфейс хранилища состояния бота.
+
+    Бэкенд без какого-либо из абстрактных методов не создаётся вовсе,
+    а не падает посреди рассылки.
+    """
+
+    @abstractmethod
+    def get_meta(self, key: str) -> Optional[str]:
+        ...
+
+    @abstractmethod
+    def set_meta(self, key: str, value: Optional[str]) -> None:
+        ...
+
+    @abstractmethod
+    def add_chat(self, chat_id: int) -> bool:
+        """Добавить чат, вернуть True, если его ещё не было"""
+
+    @abstractmethod
+    def has_chat(self, chat_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    def deactivate_chat(self, chat_id: int, reason: str) -> bool:
+        """Исключить чат из рассылок, расписание сохраняется до повторного /start"""
+
+    @abstractmethod
+    def migrate_chat(self, old_id: int, new_id: int) -> None:
+        """Перенести чат и его расписание на новый id (группа стала супергруппой)"""
+
+    @abstractmethod
+    def count_inactive(self) -> int:
+        ...
+
+    @abstractmethod
+    def set_prompt(self, chat_id: int, user_id: int, expires_at: float) -> None:
+        """Запомнить, что от пользователя в чате ждём ввода даты до expires_at"""
+
+    @abstractmethod
+    def clear_prompt(self, chat_id: int, user_id: int) -> None:
+        ...
+
+    @abstractmethod
+    def get_prompt(self, chat_id: int, user_id: int) -> Optional[float]:
+        """Срок ожидания ввода даты от пользователя в чате или None"""
+
+    @abstractmethod
+    def iter_prompts(self) -> Iterator[Tuple[int, int, float]]:
+        """Все ожидания ввода: (chat_id, user_id, expires_at)"""
+
+    def last_change(self) -> int:
+        """Номер последнего изменения чатов (0, если журнал не ведётся)"""
+        return 0
+
+    def changes_since(self, seq: int) -> Tuple[int, List[int]]:
+        """Чаты, изменённые после seq другими процессами, и новый номер"""
+        return seq, []
+
+    def trim_changes(self, seq: int) -> None:
+        pass
+
+    @abstractmethod
+    def iter_chats(self) -> Iterator[int]:
+        """Лениво перебрать id активных чатов"""
+
+    @abstractmethod
+    def count_chats(self) -> int:
+        ...
+
+    @abstractmethod
+    def get_schedule(self, chat_id: int) -> Optional[dict]:
+        """Сохранённое расписание чата или None"""
+
+    @abstractmethod
+    def set_schedule(self, chat_id: int, schedule: dict) -> None:
+        ...
+
+    @abstractmethod
+    def iter_schedules(self) -> Iterator[Tuple[int, Optional[dict]]]:
+        """Лениво перебрать активные чаты вместе с их расписаниями"""
+
+    def import_chats(self, rows: List[Tuple[int, Optional[dict]]]) -> int:
+        """Добавить пачку чатов с расписаниями (None - оставить как есть), вернуть число новых"""
+        added = 0
+        for chat_id, schedule in rows:
+            added += self.add_chat(chat_id)
+            if schedule is not None:
+                self.set_schedule(chat_id, schedule)
+        return added
+
+    def close(self) -> None:
+        pass
+
+
+class JsonStorage(Storage):
+    """Хранилище в одном JSON-файле, подходит для небольших установок"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.meta: Dict[str, Optional[str]] = {}
+        self.chats: List[int] = []
+        self.chat_set: Set[int] = set()
+        self.schedules: Dict[int, dict] = {}
+        self.inactive: Dict[int, dict] = {}
+        self.prompts: Dict[str, float] = {}
+        self.persister: Optional['WriteBehindPersister'] = None
+        self.exists = self._load()
+
+    def _load(self) -> bool:
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        self.meta['next_push_date'] = data.get('next_push_date')
+        self.chats = list(dict.fromkeys(data.get('active_chats', [])))
+        self.chat_set = set(self.chats)
+        self.schedules = {int(k): v for k, v in data.get('schedules', {}).items()}
+        self.inactive = {int(k): v for k, v in data.get('inactive_chats', {}).items()}
+        self.prompts = data.get('prompts', {})
+        return True
+
+    def snapshot(self) -> dict:
+        """Снимок состояния для записи (списки копируются)"""
+        return {
+            'next_push_date': self.meta.get('next_push_date'),
+            'active_chats': list(self.chats),
+            'schedules': {str(k): v for k, v in self.schedules.items()},
+            'inactive_chats': {str(k): v for k, v in self.inactive.items()},
+            'prompts': dict(self.prompts),
+            'last_updated': datetime.datetime.now().isoformat()
+        }
+
+    def save(self) -> None:
+        """Переписать файл целиком"""
+        write_json_atomic(self.path, self.snapshot())
+
+    def _changed(self) -> None:
+        if self.persister:
+            self.persister.mark_dirty()
+        else:
+            self.save()
+
+    def get_meta(self, key: str) -> Optional[str]:
+        return self.meta.get(key)
+
+    def set_meta(self, key: str, value: Optional[str]) -> None:
+        self.meta[key] = value
+        self._changed()
+
+    def add_chat(self, chat_id: int) -> bool:
+        if chat_id in self.chat_set:
+            return False
+        self.chat_set.add(chat_id)
+        self.chats.append(chat_id)
+        self.inactive.pop(chat_id, None)
+        self._changed()
+        return True
+
+    def has_chat(self, chat_id: int) -> bool:
+        return chat_id in self.chat_set
+
+    def deactivate_chat(self, chat_id: int, reason: str) -> bool:
+        if chat_id not in self.chat_set:
+            return False
+        self.chat_set.discard(chat_id)
+        self.chats.remove(chat_id)
+        self.inactive[chat_id] = {'reason': reason, 'since': datetime.datetime.now().isoformat()}
+        self._changed()
+        return True
+
+    def migrate_chat(self, old_id: int, new_id: int) -> None:
+        if old_id in self.chat_set:
+            self.chat_set.discard(old_id)
+            self.chats.remove(old_id)
+        if new_id not in self.chat_set:
+            self.chat_set.add(new_id)
+            self.chats.append(new_id)
+        schedule = self.schedules.pop(old_id, None)
+        if schedule is not None:
+            self.schedules.setdefault(new_id, schedule)
+        self.inactive.pop(new_id, None)
+        self.inactive[old_id] = {'reason': f'migrated to {new_id}', 'since': datetime.datetime.now().isoformat()}
+        self._changed()
+
+    def count_inactive(self) -> int:
+        return len(self.inactive)
+
+    def set_prompt(self, chat_id: int, user_id: int, expires_at: float) -> None:
+        self.prompts[f"{chat_id}:{user_id}"] = expires_at
+        self._changed()
+
+    def clear_prompt(self, chat_id: int, user_id: int) -> None:
+        if self.prompts.pop(f"{chat_id}:{user_id}", None) is not None:
+            self._changed()
+
+    def get_prompt(self, chat_id: int, user_id: int) -> Optional[float]:
+        return self.prompts.get(f"{chat_id}:{user_id}")
+
+    def iter_prompts(self) -> Iterator[Tuple[int, int, float]]:
+        for key, expires_at in list(self.prompts.items()):
+            chat_id, user_id = key.split(':')
+            yield int(chat_id), int(user_id), expires_at
+
+    def iter_chats(self) -> Iterator[int]:
+        # Мёртвые чаты удаляются прямо во время рассылки, поэтому обходим копию
+        return iter(list(self.chats))
+
+    def count_chats(self) -> int:
+        return len(self.chats)
+
+    def get_schedule(self, chat_id: int) -> Optional[dict]:
+        return self.schedules.get(chat_id)
+
+    def set_schedule(self, chat_id: int, schedule: dict) -> None:
+        self.schedules[chat_id] = schedule
+        self._changed()
+
+    def iter_schedules(self) -> Iterator[Tuple[int, Optional[dict]]]:
+        for chat_id in list(self.chats):
+            yield chat_id, self.schedules.get(chat_id)
+
+    def import_chats(self, rows: List[Tuple[int, Optional[dict]]]) -> int:
+        added = 0
+        for chat_id, schedule in rows:
+            if chat_id not in self.chat_set:
+                self.chat_set.add(chat_id)
+                self.chats.append(chat_id)
+                self.inactive.pop(chat_id, None)
+                added += 1
+            if schedule is not None:
+                self.schedules[chat_id] = schedule
+        # Файл переписывается один раз на пачку
+        self._changed()
+        return added
+
+
+@dataclass
+class PersisterStats:
+    """Метрики отложенной записи"""
+    marks: int = 0
+    flushes: int = 0
+    coalesced: int = 0
+    last_flush_seconds: float = 0.0
+    max_flush_seconds: float = 0.0
+    total_flush_seconds: float = 0.0
+
+
+class WriteBehindPersister:
+    """Отложенная запись JsonStorage в отдельном потоке.
+
+    Изменения только помечают состояние грязным; через delay секунд снимок
+    пишется на диск вне event loop, все пометки за это время сливаются в одну запись.
+    """
+
+    def __init__(self, storage: JsonStorage, delay: float = WRITE_BEHIND_DELAY):
+        self.storage = storage
+        self.delay = delay
+        self.dirty = False
+        self.pending_marks = 0
+        self.stats = PersisterStats()
+        self.lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+        storage.persister = self
+
+    def mark_dirty(self) -> None:
+        """Пометить состояние изменённым и запланировать запись"""
+        self.dirty = True
+        self.pending_marks += 1
+        self.stats.marks += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop (старт, CLI) пишем сразу
+            self._flush_now()
+            return
+        if self.task is None or self.task.done():
+            self.task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        while self.dirty:
+            await asyncio.sleep(self.delay)
+            # Запись в потоке нельзя прервать, поэтому отмена не должна её задевать
+            await asyncio.shield(self.flush())
+
+    def _take_snapshot(self) -> dict:
+        self.stats.coalesced += max(self.pending_marks - 1, 0)
+        self.pending_marks = 0
+        self.dirty = False
+        return self.storage.snapshot()
+
+    def _record(self, seconds: float) -> None:
+        self.stats.flushes += 1
+        self.stats.last_flush_seconds = seconds
+        self.stats.total_flush_seconds += seconds
+        self.stats.max_flush_seconds = max(self.stats.max_flush_seconds, seconds)
+
+    def _flush_now(self) -> None:
+        data = self._take_snapshot()
+        started = time.perf_counter()
+        write_json_atomic(self.storage.path, data)
+        self._record(time.perf_counter() - started)
+
+    async def flush(self) -> None:
+        """Записать накопленные изменения, если они есть"""
+        async with self.lock:
+            if not self.dirty:
+                return
+            data = self._take_snapshot()
+            started = time.perf_counter()
+            await asyncio.to_thread(write_json_atomic, self.storage.path, data)
+            self._record(time.perf_counter() - started)
+            logger.debug("Данные записаны за %.1fмс", self.stats.last_flush_seconds * 1000)
+
+    async def close(self) -> None:
+        """Принудительно дописать всё при остановке"""
+        if self.task and not self.task.done():
+            self.task.cancel()
+        await self.flush()
+        self.storage.persister = None
+        logger.info(
+            "Отложенная запись: %d записей, %d изменений объединено, максимум %.1fмс",
+            self.stats.flushes, self.stats.coalesced, self.stats.max_flush_seconds * 1000,
+        )
+
+
+class SqliteStorage(Storage):
+    """Хранилище в SQLite (WAL) с точечными upsert-ами"""
+
+    def __init__(self, path: str, json_path: Optional[str] = None, track_changes: bool = False):
+        self.path = path
+        # Журнал изменённых чатов нужен, когда базу делят несколько процессов
+        self.track_changes = track_changes
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS chats (
+                chat_id INTEGER PRIMARY KEY,
+                added_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS schedules (
+                chat_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS inactive_chats (
+                chat_id INTEGER PRIMARY KEY,
+                reason TEXT NOT NULL,
+                since TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS prompts (
+                chat_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (chat_id, user_id)
+            );
+            CREATE TABLE IF NOT EXISTS chat_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL
+            );
+            """
+        )
+        self.exists = self.get_meta('created_at') is not None
+        if not self.exists:
+            if json_path:
+                self._migrate_json(json_path)
+            self.set_meta('created_at', datetime.datetime.now().isoformat())
+
+    def _migrate_json(self, json_path: str) -> None:
+        """Перенести данные из bot_data.json при первом запуске"""
+        source = JsonStorage(json_path)
+        if not source.exists:
+            return
+        now = datetime.datetime.now().isoformat()
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('next_push_date', ?)",
+                (source.get_meta('next_push_date'),)
+            )
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO chats (chat_id, added_at) VALUES (?, ?)",
+                ((chat_id, now) for chat_id in source.iter_chats())
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO schedules (chat_id, data) VALUES (?, ?)",
+                ((chat_id, json.dumps(data)) for chat_id, data in source.schedules.items())
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO inactive_chats (chat_id, reason, since) VALUES (?, ?, ?)",
+                ((chat_id, info['reason'], info['since']) for chat_id, info in source.inactive.items())
+            )
+        self.exists = True
+        logger.info("Данные перенесены из %s: %d чатов", json_path, source.count_chats())
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: Optional[str]) -> None:
+        self.conn.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, value)
+        )
+
+    def add_chat(self, chat_id: int) -> bool:
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO chats (chat_id, added_at) VALUES (?, ?)",
+            (chat_id, datetime.datetime.now().isoformat())
+        )
+        if cursor.rowcount == 0:
+            return False
+        self.conn.execute("DELETE FROM inactive_chats WHERE chat_id = ?", (chat_id,))
+        self._log_change(chat_id)
+        return True
+
+    def has_chat(self, chat_id: int) -> bool:
+        row = self.conn.execute("SELECT 1 FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+        return row is not None
+
+    def deactivate_chat(self, chat_id: int, reason: str) -> bool:
+        with self.conn:
+            self.conn.execute("BEGIN")
+            cursor = self.conn.execute("DELETE FROM chats WHERE chat_id = ?", (chat_id,))
+            if cursor.rowcount == 0:
+                return False
+            self.conn.execute(
+                "INSERT OR REPLACE INTO inactive_chats (chat_id, reason, since) VALUES (?, ?, ?)",
+                (chat_id, reason, datetime.datetime.now().isoformat())
+            )
+            self._log_change(chat_id)
+        return True
+
+    def migrate_chat(self, old_id: int, new_id: int) -> None:
+        now = datetime.datetime.now().isoformat()
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.execute("DELETE FROM chats WHERE chat_id = ?", (old_id,))
+            self.conn.execute("INSERT OR IGNORE INTO chats (chat_id, added_at) VALUES (?, ?)", (new_id, now))
+            # Своё расписание у новой супергруппы важнее перенесённого
+            self.conn.execute("UPDATE OR IGNORE schedules SET chat_id = ? WHERE chat_id = ?", (new_id, old_id))
+            self.conn.execute("DELETE FROM schedules WHERE chat_id = ?", (old_id,))
+            self.conn.execute("DELETE FROM inactive_chats WHERE chat_id = ?", (new_id,))
+            self.conn.execute(
+                "INSERT OR REPLACE INTO inactive_chats (chat_id, reason, since) VALUES (?, ?, ?)",
+                (old_id, f'migrated to {new_id}', now)
+            )
+            self._log_change(old_id)
+            self._log_change(new_id)
+
+    def count_inactive(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM inactive_chats").fetchone()[0]
+
+    def set_prompt(self, chat_id: int, user_id: int, expires_at: float) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO prompts (chat_id, user_id, expires_at) VALUES (?, ?, ?)",
+            (chat_id, user_id, expires_at)
+        )
+
+    def clear_prompt(self, chat_id: int, user_id: int) -> None:
+        self.conn.execute("DELETE FROM prompts WHERE chat_id = ? AND user_id = ?", (chat_id, user_id))
+
+    def get_prompt(self, chat_id: int, user_id: int) -> Optional[float]:
+        row = self.conn.execute(
+            "SELECT expires_at FROM prompts WHERE chat_id = ? AND user_id = ?", (chat_id, user_id)
+        ).fetchone()
+        return row[0] if row else None
+
+    def iter_prompts(self) -> Iterator[Tuple[int, int, float]]:
+        return iter(self.conn.execute("SELECT chat_id, user_id, expires_at FROM prompts").fetchall())
+
+    def _log_change(self, chat_id: int) -> None:
+        if self.track_changes:
+            self.conn.execute("INSERT INTO chat_changes (chat_id) VALUES (?)", (chat_id,))
+
+    def last_change(self) -> int:
+        return self.conn.execute("SELECT COALESCE(MAX(seq), 0) FROM chat_changes").fetchone()[0]
+
+    def changes_since(self, seq: int) -> Tuple[int, List[int]]:
+        rows = self.conn.execute(
+            "SELECT seq, chat_id FROM chat_changes WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+        if not rows:
+            return seq, []
+        return rows[-1][0], list(dict.fromkeys(chat_id for _, chat_id in rows))
+
+    def trim_changes(self, seq: int) -> None:
+        self.conn.execute("DELETE FROM chat_changes WHERE seq <= ?", (seq,))
+
+    def _iter_pages(self, query: str) -> Iterator[tuple]:
+        # Постраничный обход по ключу: не держим весь список в памяти
+        # и не держим открытым курсор между await-ами рассылки
+        last = None
+        while True:
+            rows = self.conn.execute(
+                query.format(where="WHERE chats.chat_id > ?" if last is not None else ""),
+                (last, CHAT_PAGE_SIZE) if last is not None else (CHAT_PAGE_SIZE,)
+            ).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last = rows[-1][0]
+
+    def iter_chats(self) -> Iterator[int]:
+        for (chat_id,) in self._iter_pages(
+            "SELECT chat_id FROM chats {where} ORDER BY chat_id LIMIT ?"
+        ):
+            yield chat_id
+
+    def count_chats(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+
+    def get_schedule(self, chat_id: int) -> Optional[dict]:
+        row = self.conn.execute("SELECT data FROM schedules WHERE chat_id = ?", (chat_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_schedule(self, chat_id: int, schedule: dict) -> None:
+        self.conn.execute(
+            "INSERT INTO schedules (chat_id, data) VALUES (?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET data = excluded.data",
+            (chat_id, json.dumps(schedule))
+        )
+        self._log_change(chat_id)
+
+    def iter_schedules(self) -> Iterator[Tuple[int, Optional[dict]]]:
+        for chat_id, data in self._iter_pages(
+            "SELECT chats.chat_id, schedules.data FROM chats "
+            "LEFT JOIN schedules ON schedules.chat_id = chats.chat_id "
+            "{where} ORDER BY chats.chat_id LIMIT ?"
+        ):
+            yield chat_id, json.loads(data) if data else None
+
+    def import_chats(self, rows: List[Tuple[int, Optional[dict]]]) -> int:
+        now = datetime.datetime.now().isoformat()
+        with self.conn:
+            self.conn.execute("BEGIN")
+            added = self.conn.executemany(
+                "INSERT OR IGNORE INTO chats (chat_id, added_at) VALUES (?, ?)",
+                ((chat_id, now) for chat_id, _ in rows)
+            ).rowcount
+            self.conn.executemany(
+                "DELETE FROM inactive_chats WHERE chat_id = ?", ((chat_id,) for chat_id, _ in rows)
+            )
+            self.conn.executemany(
+                "INSERT INTO schedules (chat_id, data) VALUES (?, ?) "
+                "ON CONFLICT(chat_id) DO UPDATE SET data = excluded.data",
+                ((chat_id, json.dumps(schedule)) for chat_id, schedule in rows if schedule is not None)
+            )
+            if self.track_changes:
+                self.conn.executemany(
+                    "INSERT INTO chat_changes (chat_id) VALUES (?)", ((chat_id,) for chat_id, _ in rows)
+                )
+        return added
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def open_storage(backend: str, json_path: str, db_path: str, track_changes: bool = False) -> Storage:
+    """Создать хранилище по имени бэкенда: json (по умолчанию) или sqlite"""
+    if backend == 'sqlite':
+        return SqliteStorage(db_path, json_path=json_path, track_changes=track_changes)
+    if backend == 'json':
+        return JsonStorage(json_path)
+    raise ValueError(f"Неизвестный STORAGE_BACKEND: {backend}")
@@ -0,0 +1,13 @@
+import os
+import tempfile
+
+# bot.py при импорте открывает хранилище, outbox и журнал запусков в текущем
+# каталоге - уводим их во временный, чтобы тесты не трогали рабочие файлы
+_workdir = tempfile.mkdtemp(prefix='napominalka_tests_')
+os.environ.setdefault('SCHEDULE_FILE', os.path.join(_workdir, 'schedule.json'))
+os.environ.setdefault('LOG_FORMAT', 'text')
+
+
+def pytest_sessionstart(session):
+    # Пути тестов уже разобраны, модули с тестами ещё не импортированы
+    os.chdir(_workdir)
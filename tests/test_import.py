@@ -0,0 +1,52 @@
+import asyncio
+import json
+
+import pytest
+
+import bot
+
+
+@pytest.mark.parametrize('line', [
+    'not json',
+    '[1, 2]',
+    '{}',
+    '{"chat_id": "5"}',
+    '{"chat_id": true}',
+    '{"chat_id": 5, "start_date": "10.03.2026"}',
+    '{"chat_id": 5, "start_date": "2026-03-10", "interval_days": 0}',
+    '{"chat_id": 5, "start_date": "2026-03-10", "interval_days": "4"}',
+    '{"chat_id": 5, "start_date": "2026-03-10", "interval_days": true}',
+    '{"chat_id": 5, "start_date": "2026-03-10", "muted": ["nope"]}',
+    '{"chat_id": 5, "start_date": "2026-03-10", "muted": 3}',
+    '{"chat_id": 5, "start_date": "2026-03-10", "prepare_times": ["25:00"]}',
+    '{"chat_id": 5, "start_date": "2026-03-10", "push_time": "10"}',
+])
+def test_bad_line_rejected(line):
+    with pytest.raises((ValueError, KeyError, TypeError)):
+        bot.parse_chat_line(line)
+
+
+def test_chat_without_schedule():
+    assert bot.parse_chat_line('{"chat_id": -100}') == (-100, None)
+
+
+def test_schedule_keeps_only_given_fields():
+    line = json.dumps({'chat_id': 5, 'start_date': '2026-03-10', 'push_time': '09:30', 'muted': ['prepare']})
+    chat_id, data = bot.parse_chat_line(line)
+    assert chat_id == 5
+    assert data == {'start_date': '2026-03-10', 'push_time': '09:30', 'muted': ['prepare']}
+
+
+def test_import_skips_bad_lines_and_collapses_duplicates():
+    lines = [
+        '{"chat_id": 11, "start_date": "2026-03-10", "interval_days": 2}\n',
+        'garbage\n',
+        '\n',
+        '{"chat_id": 12, "start_date": "2026-03-10", "interval_days": 400}\n',
+        '{"chat_id": 11}\n',
+    ]
+    result = asyncio.run(bot.import_chats(lines))
+    assert result == {'read': 4, 'added': 1, 'duplicates': 1, 'invalid': 2}
+    # Строка без расписания не стёрла расписание из предыдущей
+    assert bot.bot_data.get_schedule(11).interval_days == 2
+    assert not bot.bot_data.storage.has_chat(12)
@@ -0,0 +1,47 @@
+import datetime
+
+import pytest
+
+from digest import event_key
+from outbox import Outbox
+
+DAY = datetime.date(2026, 3, 10)
+NOON = datetime.datetime(2026, 3, 10, 12, 0)
+
+
+@pytest.fixture
+def outbox():
+    box = Outbox(':memory:')
+    yield box
+    box.close()
+
+
+def pending(box: Outbox, job: str):
+    return list(box.iter_pending(job, DAY))
+
+
+def test_event_claimed_once_across_digest_names(outbox):
+    stats = {'daily_stats': event_key('daily_stats', NOON)}
+    assert outbox.enqueue_rows('daily_stats_12_00', DAY, [(1, 'daily_stats'), (2, 'daily_stats')], stats) == 2
+    # Повтор того же события в дайджесте с другим именем: уже поставленный тип выбрасывается
+    events = dict(stats, push_day=event_key('push_day', NOON))
+    assert outbox.enqueue_rows('push_day+daily_stats_12_00', DAY, [(1, 'push_day+daily_stats')], events) == 1
+    assert pending(outbox, 'push_day+daily_stats_12_00') == [(1, 'push_day')]
+
+
+def test_fully_claimed_row_is_dropped(outbox):
+    events = {'daily_stats': event_key('daily_stats', NOON)}
+    outbox.enqueue_rows('daily_stats_12_00', DAY, [(1, 'daily_stats')], events)
+    assert outbox.enqueue_rows('daily_stats_12_00_replay', DAY, [(1, 'daily_stats')], events) == 0
+    assert pending(outbox, 'daily_stats_12_00_replay') == []
+
+
+def test_different_fire_times_are_separate_events(outbox):
+    later = NOON + datetime.timedelta(days=1)
+    outbox.enqueue_rows('a', DAY, [(1, 'daily_stats')], {'daily_stats': event_key('daily_stats', NOON)})
+    assert outbox.enqueue_rows('b', DAY, [(1, 'daily_stats')], {'daily_stats': event_key('daily_stats', later)}) == 1
+
+
+def test_rows_without_events_are_not_claimed(outbox):
+    assert outbox.enqueue('daily_stats', 'a', DAY, [1]) == 1
+    assert outbox.enqueue('daily_stats', 'b', DAY, [1]) == 1
@@ -0,0 +1,101 @@
+import datetime
+
+import pytest
+import pytz
+
+from scheduler import (
+    PREPARE, PUSH_DAY, ChatSchedule, first_cycle_after, first_cycle_on_or_after, project_calendar,
+)
+
+TZ = pytz.timezone('Europe/Moscow')
+TODAY = datetime.date(2026, 3, 10)
+
+
+def loop_next_push(start_date: datetime.date, interval: int, today: datetime.date) -> datetime.date:
+    """Прежний расчёт PushScheduler.calculate_next_push_from_today с циклом"""
+    if start_date > today:
+        return start_date
+    cycles = (today - start_date).days // interval
+    next_date = start_date + datetime.timedelta(days=(cycles + 1) * interval)
+    while next_date <= today:
+        next_date += datetime.timedelta(days=interval)
+    return next_date
+
+
+@pytest.mark.parametrize('interval', [1, 2, 3, 4, 7, 30])
+def test_first_cycle_after_matches_loop(interval):
+    for offset in range(-3 * interval - 5, 3 * interval + 5):
+        start = TODAY + datetime.timedelta(days=offset)
+        assert first_cycle_after(start, interval, TODAY) == loop_next_push(start, interval, TODAY)
+
+
+@pytest.mark.parametrize('interval', [1, 4, 7])
+def test_first_cycle_on_or_after_includes_day(interval):
+    for offset in range(-2 * interval, 2 * interval):
+        start = TODAY + datetime.timedelta(days=offset)
+        first = first_cycle_on_or_after(start, interval, TODAY)
+        assert first >= TODAY
+        assert (first - start).days % interval == 0
+        assert first - datetime.timedelta(days=interval) < TODAY or first == start
+
+
+def at(day: datetime.date, hour: int, minute: int = 0) -> datetime.datetime:
+    return TZ.localize(datetime.datetime.combine(day, datetime.time(hour, minute)))
+
+
+@pytest.fixture
+def daily() -> ChatSchedule:
+    # Пуш каждый день в 10:00, напоминания о подготовке накануне в 11:00, 19:00, 23:30
+    return ChatSchedule(1, TODAY - datetime.timedelta(days=5), interval_days=1)
+
+
+def test_next_event_before_push_time(daily):
+    assert daily.next_event(at(TODAY, 9, 59)) == (at(TODAY, 10), PUSH_DAY)
+
+
+def test_next_event_exactly_at_push_time_moves_on(daily):
+    # Событие ищется строго после after: сегодняшний пуш уже прошёл,
+    # следующим идёт напоминание о завтрашнем
+    assert daily.next_event(at(TODAY, 10)) == (at(TODAY, 11), PREPARE)
+
+
+def test_next_event_after_last_prepare(daily):
+    tomorrow = TODAY + datetime.timedelta(days=1)
+    assert daily.next_event(at(TODAY, 23, 30)) == (at(tomorrow, 10), PUSH_DAY)
+
+
+def test_next_event_walks_whole_day(daily):
+    moment = at(TODAY, 0)
+    seen = []
+    while moment < at(TODAY + datetime.timedelta(days=1), 0):
+        moment, kind = daily.next_event(moment)
+        seen.append((moment.strftime('%H:%M'), kind))
+    assert seen[:4] == [('10:00', PUSH_DAY), ('11:00', PREPARE), ('19:00', PREPARE), ('23:30', PREPARE)]
+
+
+def test_next_event_before_future_start():
+    start = TODAY + datetime.timedelta(days=3)
+    schedule = ChatSchedule(1, start, interval_days=4)
+    day_before = start - datetime.timedelta(days=1)
+    assert schedule.next_event(at(TODAY, 12)) == (at(day_before, 11), PREPARE)
+    assert schedule.next_event(at(day_before, 23, 30)) == (at(start, 10), PUSH_DAY)
+
+
+def test_project_calendar_matches_per_chat_dates():
+    schedules = [
+        ChatSchedule(chat_id, TODAY + datetime.timedelta(days=chat_id % 9 - 4), interval_days=chat_id % 5 + 1)
+        for chat_id in range(1, 60)
+    ]
+    days = 21
+    calendar = project_calendar(schedules, TODAY, days)
+    push_counts = [0] * days
+    prepare_counts = [0] * days
+    for schedule in schedules:
+        for push_date in schedule.push_dates(TODAY, days + 1):
+            day = (push_date - TODAY).days
+            if day < days:
+                push_counts[day] += 1
+            if day >= 1:
+                prepare_counts[day - 1] += 1
+    assert calendar.push_counts == push_counts
+    assert calendar.prepare_counts == prepare_counts